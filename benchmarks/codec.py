@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# Compares the storage format of the raids with the legacy pickle
+# Run it from the root of the repository with `python3 -m benchmarks.codec`
+import pickle
+import timeit
+import tracemalloc
+
+from telegram import User
+
+from pogoraidbot.raid import codec
+from .fixtures import make_raid
+
+
+if __name__ == "__main__":
+    n = 10000
+
+    print("{:>12} {:>8} {:>12} {:>12} {:>8}".format("participants", "format", "encode (us)", "decode (us)", "bytes"))
+
+    for participants in [0, 10, 50, 200]:
+        raid = make_raid(participants)
+
+        for name, dumps, loads in [("pickle", pickle.dumps, pickle.loads), ("codec", codec.encode, codec.decode)]:
+            data = dumps(raid)
+
+            encode = timeit.timeit(lambda: dumps(raid), number=n) / n * 1e6
+            decode = timeit.timeit(lambda: loads(data), number=n) / n * 1e6
+
+            print("{:>12} {:>8} {:>12.1f} {:>12.1f} {:>8}".format(participants, name, encode, decode, len(data)))
+
+    print()
+    print("{:>12} {:>16} {:>16}".format("participants", "blob (bytes)", "field (bytes)"))
+
+    # Bytes written by a button press, the whole raid against the single participant
+    for participants in [0, 10, 50, 200]:
+        raid = make_raid(participants)
+        raid.add_participant(User(1, "Trainer", False))
+
+        print("{:>12} {:>16} {:>16}".format(participants, len(codec.encode(raid)),
+                                             len(codec.encode_participant(raid.participants[1]))))
+
+    print()
+    print("{:>12} {:>16}".format("participants", "memory (bytes)"))
+
+    # Memory of a decoded raid, as it is kept while an update is handled
+    for participants in [0, 10, 50, 200]:
+        data = codec.encode(make_raid(participants))
+
+        tracemalloc.start()
+        raids = [codec.decode(data) for _ in range(100)]
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        print("{:>12} {:>16.0f}".format(participants, size / len(raids)))
@@ -0,0 +1,24 @@
+# Raids shared by the benchmarks
+import datetime
+
+from pogoraidbot.data import Boss, Gym
+from pogoraidbot.raid import Raid, Participant
+
+
+def make_raid(participants: int) -> Raid:
+    # The names and the types of the participants vary, so the escaping and each line of the render are measured
+    types = list(Participant.Type)
+
+    return Raid(gym=Gym("Fontana del Nettuno (Piazza)", 44.494, 11.342),
+                level=5,
+                is_hatched=True,
+                end=datetime.time(18, 42, 11),
+                hatching=datetime.time(17, 57),
+                hangout=datetime.time(18, 20),
+                boss=Boss("Mewtwo", 5, True),
+                is_aprx_time=True,
+                is_check_enabled=True,
+                participants={100000 + i: Participant(100000 + i, "Trainer_{}.{}".format(i, "*" * (i % 3)),
+                                                      type=types[i % len(types)], number=1 + i % 3,
+                                                      is_ready=i % 2 == 0)
+                              for i in range(participants)})
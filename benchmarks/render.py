@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# Compares the cached rendering of the raid messages with the previous one, the output must be the same
+# Run it from the root of the repository with `python3 -m benchmarks.render`
+import timeit
+
+from telegram import User
+from telegram.utils import helpers
+
+from pogoraidbot.raid import Raid, _header, _participant, _times
+from .fixtures import make_raid
+
+
+def legacy_to_msg(self: Raid) -> str:
+    # The renderer before the cached fragments, kept as the reference of the output
+    msg = ""
+
+    if self.is_ex:
+        msg += "*EX*"
+
+    if self.gym.latitude is not None and self.gym.longitude is not None:
+        msg += "[{}]({})".format(
+            helpers.escape_markdown(self.gym.name, version=2),
+            helpers.escape_markdown(self.gym.map, version=2))
+    else:
+        msg += "{}".format(helpers.escape_markdown(self.gym.name, version=2))
+
+    msg += "\n\n"
+
+    if self.boss is not None:
+        if self.boss.is_there_shiny:
+            msg += "\U00002728*{}*\U00002728".format(self.boss.name)
+        else:
+            msg += "{}".format(self.boss.name)
+        msg += "\n"
+
+    if self.effective_level is not None:
+        msg += "\U00002B50" * self.effective_level
+        msg += "\n"
+
+    msg += "\n"
+
+    if self.hatching is not None:
+        msg += "`Hatching:   {}{}`\n".format("~" if self.is_aprx_time else " ", self.hatching.strftime('%H:%M'))
+
+    if self.end is not None:
+        msg += "`Ends:       {}{}`\n".format("~" if self.is_aprx_time else " ", self.end.strftime('%H:%M'))
+
+    if self.hangout is not None:
+        msg += "`Hangout:     {}`\n".format(self.hangout.strftime('%H:%M'))
+
+    if self.participants_count > 0:
+        msg += "`─────────────────────`\n"
+
+        for p_id, p in self.participants.items():
+            if self.is_check_enabled:
+                msg += "\U00002705 " if p.is_ready else "\U0000274C "
+
+            msg += helpers.mention_markdown(p_id, p.name, version=2)
+
+            if p.is_remote:
+                msg += " \U0001F3E1"
+            if p.is_remote_invite:
+                msg += " \U0001F48C"
+            if p.is_flyer:
+                msg += " \U00002708"
+
+            if p.number > 1:
+                msg += " \\+{}".format(p.number - 1)
+
+            msg += "\n"
+
+        msg += "`─────────────────────`\n"
+
+        if self.is_check_enabled:
+            msg += "__*All participants are ready*__\n" if self.are_all_ready else "__*Not all participants are ready*__\n"
+
+        msg += "*{}* participants\n".format(self.participants_count)
+
+    msg += "`[{}]`".format(self.code)
+
+    return msg
+
+
+if __name__ == "__main__":
+    n = 2000
+
+    print("{:>12} {:>14} {:>14} {:>14}".format("participants", "legacy (us)", "cold (us)", "press (us)"))
+
+    for participants in [0, 10, 50, 200]:
+        raid = make_raid(participants)
+        user = User(100000, "Trainer_0.", False)
+
+        # Each press changes a single participant, the other lines come from the cache
+        def press():
+            raid.toggle_ready(user)
+            return raid.to_msg()
+
+        for _ in range(4):
+            assert press() == legacy_to_msg(raid)
+
+        legacy = timeit.timeit(lambda: legacy_to_msg(raid), number=n) / n * 1e6
+        press_time = timeit.timeit(press, number=n) / n * 1e6
+
+        # Without the cache each fragment is escaped again, as after a restart
+        def cold():
+            for f in (_header, _times, _participant):
+                f.cache_clear()
+            return raid.to_msg()
+
+        cold_time = timeit.timeit(cold, number=n // 10) / (n // 10) * 1e6
+
+        print("{:>12} {:>14.1f} {:>14.1f} {:>14.1f}".format(participants, legacy, cold_time, press_time))
@@ -11,7 +11,12 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(prog="pogoraidbot")
 
     parser.add_argument("-t", "--token", dest="token", help="telegram bot token")
-    parser.add_argument("-r", "--redis", dest="redis", help="redis url in \"redis://{host}[:port]/{db}\" format")
+    parser.add_argument("-r", "--redis", dest="redis",
+                        help="redis url in \"redis://{host}[:port]/{db}\" format, "
+                             "\"redis+sentinel://{host}:{port}[,...]/{service}[/{db}][?sentinel_password={password}]\" "
+                             "for a sentinel or "
+                             "\"redis+cluster://{host}:{port}[,...]\" for a cluster")
+    parser.add_argument("--redis-pool-size", dest="redis_pool_size", help="maximum number of connections to redis")
     parser.add_argument("-a", "--superadmin", dest="superadmin", help="superadmin's id")
     parser.add_argument("-b", "--bosses-file", dest="bosses_file",
                         help="JSON or CSV file contains possible pokémons in the raids. It can be also provided over http(s)")
@@ -23,6 +28,27 @@ if __name__ == "__main__":
                         help="Validity of the gyms list in hours")
     parser.add_argument("-e", "--env", dest="env", action="store_true",
                         help="Use environment variables for the configuration")
+    parser.add_argument("-w", "--workers", dest="workers",
+                        help="number of threads that handle the updates, "
+                             "it bounds the updates handled at the same time")
+    parser.add_argument("--scan-workers", dest="scan_workers", help="number of screenshots scanned at the same time")
+    parser.add_argument("--scan-memory", dest="scan_memory",
+                        help="maximum memory in MiB of the screenshots decoded at the same time")
+    parser.add_argument("--render-window", dest="render_window",
+                        help="minimum seconds between two updates of the message of a raid")
+    parser.add_argument("--reminder-lead", dest="reminder_lead",
+                        help="minutes before the hangout when the participants are reminded, 0 disables them")
+    parser.add_argument("--webhook-url", dest="webhook_url",
+                        help="public url of the webhook, if it is provided the bot doesn't use the polling")
+    parser.add_argument("--webhook-listen", dest="webhook_listen", help="address where the webhook server listens")
+    parser.add_argument("--webhook-port", dest="webhook_port", help="port where the webhook server listens")
+    parser.add_argument("--webhook-path", dest="webhook_path", help="path of the webhook")
+    parser.add_argument("--webhook-secret", dest="webhook_secret",
+                        help="secret token that Telegram must send with each update")
+    parser.add_argument("--webhook-max-connections", dest="webhook_max_connections",
+                        help="maximum number of concurrent webhook requests")
+    parser.add_argument("-c", "--cluster", dest="cluster", action="store_const", const=True,
+                        help="run as a replica of a cluster of bots that share the same redis")
     parser.add_argument("-d", "--debug-folder", dest="debug_folder", help="debug folder")
     parser.add_argument("-v", dest="log_level", action="count",
                         help="number of -v specifics level of verbosity")
@@ -39,11 +65,24 @@ if __name__ == "__main__":
         env = {
             "token": os.getenv("PGRB_BOT_TOKEN"),
             "redis": os.getenv("PGRB_BOT_REDIS"),
+            "redis_pool_size": os.getenv("PGRB_BOT_REDIS_POOL_SIZE"),
             "superadmin": os.getenv("PGRB_BOT_SUPERADMIN"),
             "gyms_file": os.getenv("PGRB_BOT_GYMS_FILE"),
             "gyms_expiration": os.getenv("PGRB_BOT_GYMS_EXPIRATION"),
             "bosses_file": os.getenv("PGRB_BOT_BOSSES_FILE"),
             "bosses_expiration": os.getenv("PGRB_BOT_BOSSES_EXPIRATION"),
+            "workers": os.getenv("PGRB_BOT_WORKERS"),
+            "scan_workers": os.getenv("PGRB_BOT_SCAN_WORKERS"),
+            "scan_memory": os.getenv("PGRB_BOT_SCAN_MEMORY"),
+            "render_window": os.getenv("PGRB_BOT_RENDER_WINDOW"),
+            "reminder_lead": os.getenv("PGRB_BOT_REMINDER_LEAD"),
+            "webhook_url": os.getenv("PGRB_BOT_WEBHOOK_URL"),
+            "webhook_listen": os.getenv("PGRB_BOT_WEBHOOK_LISTEN"),
+            "webhook_port": os.getenv("PGRB_BOT_WEBHOOK_PORT"),
+            "webhook_path": os.getenv("PGRB_BOT_WEBHOOK_PATH"),
+            "webhook_secret": os.getenv("PGRB_BOT_WEBHOOK_SECRET"),
+            "webhook_max_connections": os.getenv("PGRB_BOT_WEBHOOK_MAX_CONNECTIONS"),
+            "cluster": os.getenv("PGRB_BOT_CLUSTER"),
             "log_level": os.getenv("PGRB_BOT_LOG_LEVEL")
         }
 
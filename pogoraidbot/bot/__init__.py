@@ -2,27 +2,46 @@ from __future__ import annotations
 
 import datetime
 import functools
+import hashlib
 import logging
 import os
-import pickle
 import re
+import signal
 import sys
+import threading
+import time
 import traceback
-from typing import Callable
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Callable, Dict, List, Tuple, Union
 
 import cv2
 from apscheduler.schedulers.background import BackgroundScheduler
-from redis import StrictRedis, exceptions
+from mpu.string import str2bool
+from redis import exceptions
+from redis.client import Pipeline
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, ParseMode, Update, Bot, Message, error
-from telegram.ext import Updater, MessageHandler, CallbackQueryHandler, CommandHandler, CallbackContext
+from telegram.ext import Updater, MessageHandler, CallbackQueryHandler, CommandHandler, CallbackContext, \
+    TypeHandler, DispatcherHandlerStop
 from telegram.ext.filters import Filters
+from telegram.utils.request import Request
 
 from . import about
+from .admins import AdminCache
+from .album import AlbumCollector
 from .exceptions import ImpossibleRetrieveRaidFromDB, ImpossibleRetrieveRaidFromReply
-from .. import redis_keys
-from ..data import bosses, gyms
-from ..raid import Raid
-from ..screenshot import ScreenshotRaid
+from .render import RenderCoalescer
+from .. import redis_client, redis_keys
+from ..cluster import Cluster
+from ..config import ConfigCache
+from ..data import bosses, gyms, DataList
+from ..metrics import RoundTrips
+from ..outbound import OutboundQueue, Priority
+from ..raid import Raid, nearest_timestamp
+from ..raid.exceptions import DuplicateOperation, InvalidRaidData, RaidNotFound
+from ..raid.store import RaidStore
+from ..reminders import Reminders
+from ..screenshot import Downloader, ScreenshotRaid, MemoryGovernor
+from ..webhook import WebhookServer
 
 _LOGGER = logging.getLogger(__package__)
 
@@ -32,6 +51,7 @@ class PoGORaidBot:
         class ChatMustBeEnabled:
             def __init__(self, func: Callable[[PoGORaidBot, Update, CallbackContext], bool]):
                 self.func = func
+                functools.update_wrapper(self, func, updated=())
 
             def __get__(self, obj, objtype):
                 """Support instance methods."""
@@ -44,7 +64,7 @@ class PoGORaidBot:
                     chat_id = update.callback_query.message.chat_id
 
                 # Check if this chat is enabled
-                if not inst._redis.sismember(redis_keys.ENABLEDCHAT, chat_id):
+                if not inst._config.contains(redis_keys.ENABLEDCHAT, chat_id):
                     _LOGGER.info("Chat {} is not enabled".format(chat_id))
 
                     return False
@@ -54,23 +74,16 @@ class PoGORaidBot:
         class UserMustBeAdmin:
             def __init__(self, func: Callable[[PoGORaidBot, Update, CallbackContext], bool]):
                 self.func = func
+                functools.update_wrapper(self, func, updated=())
 
             def __get__(self, obj, objtype):
                 """Support instance methods."""
                 return functools.partial(self.__call__, obj)
 
             def __call__(self, inst: PoGORaidBot, update: Update, context: CallbackContext) -> bool:
-                is_admin = False
                 # If the chat is private doesn't check administrators
-                if update.message.chat.type == update.message.chat.PRIVATE:
-                    is_admin = True
-                else:
-                    # Get the list of administrators of a chat
-                    for a in context.bot.get_chat_administrators(update.message.chat.id):
-                        # Check if the current admin in the user
-                        if a.user.id == update.message.from_user.id:
-                            is_admin = True
-                            break
+                is_admin = update.message.chat.type == update.message.chat.PRIVATE or \
+                    inst._admins.is_admin(update.message.chat.id, update.message.from_user.id)
 
                 # Check if the sender is an admin
                 if not is_admin:
@@ -83,6 +96,7 @@ class PoGORaidBot:
         class UserMustBeBotAdmin:
             def __init__(self, func: Callable[[PoGORaidBot, Update, CallbackContext], bool]):
                 self.func = func
+                functools.update_wrapper(self, func, updated=())
 
             def __get__(self, obj, objtype):
                 """Support instance methods."""
@@ -90,40 +104,93 @@ class PoGORaidBot:
 
             def __call__(self, inst: PoGORaidBot, update: Update, context: CallbackContext) -> bool:
                 # Check if the user is a bot admin
-                if not inst._redis.sismember(redis_keys.ADMIN, update.message.from_user.id):
+                if not inst._config.contains(redis_keys.ADMIN, update.message.from_user.id):
                     _LOGGER.warning("User {} is not a bot admin".format(update.message.from_user.id))
 
                     return False
 
                 return self.func(inst, update, context)
 
+        class RunAsync:
+            def __init__(self, func: Callable[[PoGORaidBot, Update, CallbackContext], bool]):
+                self.func = func
+                functools.update_wrapper(self, func, updated=())
+
+            def __get__(self, obj, objtype):
+                """Support instance methods."""
+                return functools.partial(self.__call__, obj)
+
+            def __call__(self, inst: PoGORaidBot, update: Update, context: CallbackContext) -> None:
+                # Move the handler to the workers pool, so the dispatcher is free to accept the next update
+                # The Dispatcher of python-telegram-bot 12 is threaded, each update in flight holds a worker
+                inst._updater.dispatcher.run_async(self._measured, inst, update, context)
+
+            def _measured(self, inst: PoGORaidBot, update: Update, context: CallbackContext) -> bool:
+                # Count the redis round trips of the update
+                with inst._round_trips.measure(self.func.__name__):
+                    return self.func(inst, update, context)
+
     def __init__(self,
                  token: str,
                  redis: str = "redis://127.0.0.1:6379/0",
+                 redis_pool_size: int = None,
                  superadmin: int = None,
                  bosses_file: str = None,
                  bosses_expiration: int = 12,
                  gyms_file: str = None,
                  gyms_expiration: int = 12,
-                 debug_folder: str = None
+                 debug_folder: str = None,
+                 workers: int = 8,
+                 scan_workers: int = 2,
+                 scan_memory: int = 256,
+                 render_window: float = 1.0,
+                 reminder_lead: int = 5,
+                 webhook_url: str = None,
+                 webhook_listen: str = "0.0.0.0",
+                 webhook_port: int = 8443,
+                 webhook_path: str = "/",
+                 webhook_secret: str = None,
+                 webhook_max_connections: int = 40,
+                 cluster: bool = False
                  ):
-        # Init and test redis connection
-        self._redis = StrictRedis.from_url(url=redis, charset="utf-8", decode_responses=False)
+        # By default there is a connection for each thread that can use redis at the same time
+        if redis_pool_size is None:
+            redis_pool_size = int(workers) + int(scan_workers) + 8
 
+        # Init and test redis connection, the commands are retried while redis is unreachable
         _LOGGER.info("Try to connect to Redis...")
         try:
+            self._redis = redis_client.connect(redis, pool_size=int(redis_pool_size))
             self._redis.ping()
-        except exceptions.ConnectionError:
+        except exceptions.RedisError:
             _LOGGER.critical("Unable to connect to Redis")
             sys.exit()
+
+        # Count the round trips of each update
+        self._round_trips = RoundTrips()
+        self._redis.round_trips = self._round_trips
         _LOGGER.info("Successfully connected to Redis")
 
+        # Init the cluster membership, a single instance is always the leader without taking the lease
+        self._is_clustered = cluster if isinstance(cluster, bool) else str2bool(cluster)
+        self._cluster = Cluster(self._redis, is_enabled=self._is_clustered)
+        self._cluster.heartbeat()
+
+        # Digests of the lists shared through redis, starting from the ones loaded from the files
+        self._lists_digest = {}
+
+        # Mirror the configuration sets in memory
+        self._config = ConfigCache(self._redis)
+
         # Save superadmin
         self._superadmin = int(superadmin) if superadmin is not None else None
         # Add superadmin to the admins db
         if self._superadmin is not None:
             self._redis.set(redis_keys.SUPERADMIN, self._superadmin)
-            self._redis.sadd(redis_keys.ADMIN, self._superadmin)
+            self._config.add(redis_keys.ADMIN, self._superadmin)
+
+        # Init the storage of the raids, the raids saved by the previous versions are converted on their first use
+        self._raids = RaidStore(self._redis)
 
         # Save debug folder
         self._debug_folder = debug_folder
@@ -132,16 +199,51 @@ class PoGORaidBot:
             ScreenshotRaid.debug = True
             _LOGGER.info("\"{}\" was set as debug folder".format(self._debug_folder))
 
-        # Init the bot
-        self._bot = Bot(token)
+        # Save the webhook configuration, without an url the bot uses the polling
+        self._webhook_url = webhook_url
+        self._webhook_listen = webhook_listen
+        self._webhook_port = int(webhook_port)
+        self._webhook_path = webhook_path
+        self._webhook_secret = webhook_secret
+        self._webhook_max_connections = int(webhook_max_connections)
+
+        # Init the pool used to scan the screenshots, the OCR is kept apart from the interactive handlers
+        self._scan_executor = ThreadPoolExecutor(max_workers=int(scan_workers), thread_name_prefix="scan")
+
+        # Init the downloader of the screenshots, with a connection and a buffer for each scan
+        self._downloader = Downloader(pool_size=int(scan_workers))
+
+        # Init the governor that caps the memory of the decoded screenshots in flight (in MiB)
+        self._scan_memory = MemoryGovernor(int(scan_memory) * 1024 * 1024)
+
+        # Init the collector of the screenshots sent as album
+        self._albums = AlbumCollector(self._scan_album)
+
+        # Init the coalescer that updates the message of a raid at most once for each window (in seconds)
+        self._renders = RenderCoalescer(self._flush_raid, float(render_window))
+
+        # Init the bot with a connection pool large enough for workers, scans and updater
+        self._bot = Bot(token, request=Request(con_pool_size=int(workers) + int(scan_workers) + 4))
+
+        # Init the queue that sends the requests to Telegram within its limits
+        self._outbound = OutboundQueue()
 
         # Init updater
-        self._updater = Updater(bot=self._bot, use_context=True)
+        self._updater = Updater(bot=self._bot, use_context=True, workers=int(workers))
 
         # Get the id of the bot
         self._id = self._bot.get_me().id
 
+        # Init the cache of the administrators of the chats
+        self._admins = AdminCache(self._bot)
+
+        # Init the reminders of the hangouts (in minutes), each replica sends the ones it claims
+        self._reminders = Reminders(self._redis, self._remind_raid, lead=int(reminder_lead) * 60)
+
         # Set the handler functions
+        # Set the handler that drops the updates already processed by another replica
+        if self._is_clustered:
+            self._updater.dispatcher.add_handler(TypeHandler(Update, self._handler_dedup), group=-1)
         # Set the handler for screens
         self._updater.dispatcher.add_handler(MessageHandler(Filters.photo, self._handler_screenshot))
         # Set the handler to set the hangout
@@ -152,6 +254,10 @@ class PoGORaidBot:
         # Set the handler for the pinned message notify
         self._updater.dispatcher.add_handler(MessageHandler(Filters.status_update.pinned_message,
                                                             self._handler_event_pinned))
+        # Set the handler for the members that join or leave a chat
+        self._updater.dispatcher.add_handler(MessageHandler(
+            Filters.status_update.new_chat_members | Filters.status_update.left_chat_member,
+            self._handler_event_members))
         # Set the handler to set the boss
         self._updater.dispatcher.add_handler(MessageHandler(
             Filters.reply & Filters.regex(r"^\s*[a-zA-Z]+\s*$"), self._handler_set_boss))
@@ -174,6 +280,9 @@ class PoGORaidBot:
         # Set the handler for removeadmin command
         self._updater.dispatcher.add_handler(CommandHandler("removeadmin", self._handler_command_removeadmin,
                                                             Filters.reply))
+        # Set the handlers for mirror and unmirror commands
+        self._updater.dispatcher.add_handler(CommandHandler("mirror", self._handler_command_mirror))
+        self._updater.dispatcher.add_handler(CommandHandler("unmirror", self._handler_command_unmirror))
         # Set the handler for check command
         self._updater.dispatcher.add_handler(CommandHandler("check", self._handler_command_check, Filters.reply))
 
@@ -183,57 +292,249 @@ class PoGORaidBot:
         # Creates background scheduler for update the db
         self._scheduler = BackgroundScheduler(daemon=True)
 
-        # Creates job to update bosses list
-        if bosses_file is not None:
-            bosses.load_from(bosses_file)
-            self._scheduler.add_job(lambda: bosses.load_from(bosses_file), 'interval', hours=int(bosses_expiration))
+        # Creates job to keep the leadership of the cluster
+        self._scheduler.add_job(self._cluster.heartbeat, 'interval', seconds=5)
 
-        # Creates job to update gyms list
+        # Creates job to report the redis round trips of the updates
+        self._scheduler.add_job(lambda: _LOGGER.info("Redis round trips: {}".format(self._round_trips.summary())),
+                                'interval', minutes=10)
+
+        # Creates job to report the state of the queue of the requests to Telegram
+        self._scheduler.add_job(lambda: _LOGGER.info("Outbound queue: {}".format(self._outbound.summary())),
+                                'interval', minutes=10)
+
+        # Creates job to close the ended raids
+        self._scheduler.add_job(self._cluster.leader_only(self._sweep_raids), 'interval', minutes=1)
+
+        # Creates job to update bosses list, the leader fetches it and the replicas take it from redis
+        if bosses_file is not None:
+            self._load_list("bosses", bosses, bosses_file)
+            if self._is_clustered and self._cluster.is_leader:
+                self._refresh_list("bosses", bosses, bosses_file)
+            self._scheduler.add_job(self._cluster.leader_only(self._refresh_list), 'interval',
+                                    hours=int(bosses_expiration), args=["bosses", bosses, bosses_file])
+            if self._is_clustered:
+                self._scheduler.add_job(self._sync_list, 'interval', minutes=1, args=["bosses", bosses])
+
+        # Creates job to update gyms list, the leader fetches it and the replicas take it from redis
         if gyms_file is not None:
-            gyms.load_from(gyms_file)
-            self._scheduler.add_job(lambda: gyms.load_from(gyms_file), 'interval', hours=int(gyms_expiration))
+            self._load_list("gyms", gyms, gyms_file)
+            if self._is_clustered and self._cluster.is_leader:
+                self._refresh_list("gyms", gyms, gyms_file)
+            self._scheduler.add_job(self._cluster.leader_only(self._refresh_list), 'interval',
+                                    hours=int(gyms_expiration), args=["gyms", gyms, gyms_file])
+            if self._is_clustered:
+                self._scheduler.add_job(self._sync_list, 'interval', minutes=1, args=["gyms", gyms])
 
         # Starts the scheduler
         self._scheduler.start()
 
+        # Starts the loop of the reminders
+        self._reminders.start()
+
         _LOGGER.info("Bot ready")
 
     def listen(self) -> None:
         _LOGGER.info("Start listening")
 
-        # Begin to listen
-        self._updater.start_polling()
+        if self._webhook_url is not None:
+            self._listen_webhook()
+        elif self._is_clustered:
+            self._listen_cluster()
+        else:
+            # Begin to listen
+            self._updater.start_polling()
+            # Wait
+            self._updater.idle()
+
+        # Stop the scans pool
+        self._scan_executor.shutdown(wait=False)
+
+        # Stop the jobs before releasing the leadership, so the heartbeat doesn't take it again
+        self._scheduler.shutdown(wait=False)
+        self._cluster.release()
+
+    def _listen_webhook(self) -> None:
+        # Register the webhook on Telegram
+        options = {"max_connections": self._webhook_max_connections}
+        if self._webhook_secret is not None:
+            options["secret_token"] = self._webhook_secret
+        self._bot.set_webhook(url=self._webhook_url, **options)
+
+        _LOGGER.info("Webhook set to {}".format(self._webhook_url))
+
+        # Create the server that feeds the updates to the dispatcher
+        server = WebhookServer((self._webhook_listen, self._webhook_port),
+                               self._bot,
+                               self._updater.update_queue,
+                               path=self._webhook_path,
+                               secret=self._webhook_secret,
+                               max_connections=self._webhook_max_connections)
+
+        # Start the dispatcher
+        threading.Thread(target=self._updater.dispatcher.start, name="dispatcher", daemon=True).start()
+
+        # Stop the server on the termination signals, the shutdown must come from another thread
+        for s in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(s, lambda *_: threading.Thread(target=server.shutdown).start())
+
+        _LOGGER.info("Webhook server listening on {}:{}".format(self._webhook_listen, self._webhook_port))
+
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            self._updater.dispatcher.stop()
+
+    def _listen_cluster(self) -> None:
+        stop = threading.Event()
+
+        # Start the dispatcher
+        threading.Thread(target=self._updater.dispatcher.start, name="dispatcher", daemon=True).start()
+
+        # The leader polls Telegram and each replica consumes a share of the updates
+        threading.Thread(target=self._cluster.poll, args=(self._bot, stop), name="poller", daemon=True).start()
+        threading.Thread(target=self._cluster.consume, args=(self._bot, self._updater.update_queue, stop),
+                         name="consumer", daemon=True).start()
+
+        for s in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(s, lambda *_: stop.set())
+
+        _LOGGER.info("Node {} joined the cluster".format(self._cluster.node_id))
+
         # Wait
-        self._updater.idle()
+        stop.wait()
+
+        self._updater.dispatcher.stop()
+
+    def _load_list(self, name: str, data_list: DataList, file: str) -> None:
+        raw = DataList.fetch(file)
+
+        # The digest of the loaded list keeps a stale shared copy from replacing it
+        if raw is not None and data_list.load(raw):
+            self._lists_digest[name] = hashlib.sha1(raw.encode()).hexdigest()
+
+    def _refresh_list(self, name: str, data_list: DataList, file: str) -> None:
+        # A single instance doesn't share the list
+        if not self._is_clustered:
+            self._load_list(name, data_list, file)
+            return
+
+        raw = DataList.fetch(file)
+
+        if raw is None:
+            return
+
+        # Share the list with the other replicas
+        self._redis.hset(redis_keys.DATA.format(name), mapping={
+            "raw": raw,
+            "digest": hashlib.sha1(raw.encode()).hexdigest()
+        })
+
+        self._sync_list(name, data_list)
+
+    def _sync_list(self, name: str, data_list: DataList) -> None:
+        # Check if the shared list is changed
+        digest = self._redis.hget(redis_keys.DATA.format(name), "digest")
+        if digest is None or digest.decode() == self._lists_digest.get(name):
+            return
+
+        if data_list.load(self._redis.hget(redis_keys.DATA.format(name), "raw").decode()):
+            self._lists_digest[name] = digest.decode()
+
+    def _sweep_raids(self) -> None:
+        # The ended raids can't be joined anymore, their buttons are removed and they are unpinned
+        for chat_id, code, message_id, pinned in self._raids.sweep():
+            _LOGGER.info("Raid {} of chat {} is ended".format(code, chat_id))
+
+            # The removal of the buttons replaces any pending edit of the messages
+            for target_chat_id, target_message_id in [(chat_id, message_id),
+                                                      *self._mirrors_of(chat_id, code).items()]:
+                self._outbound.submit(Priority.EDIT, target_chat_id, self._bot.edit_message_reply_markup,
+                                      target_chat_id, target_message_id, reply_markup=None,
+                                      key=(target_chat_id, target_message_id))
+            if pinned:
+                self._outbound.submit(Priority.DELETE, chat_id, self._bot.unpin_chat_message, chat_id,
+                                      message_id=message_id)
+
+    def _remind_raid(self, chat_id: int, code: str) -> None:
+        try:
+            raid = self._raids.load(chat_id, code)
+        except (RaidNotFound, InvalidRaidData):
+            return
+
+        # A reminder claimed again after the hangout is useless
+        minutes = int(nearest_timestamp(raid.hangout) - time.time()) // 60 if raid.hangout is not None else -1
+        if minutes < 0 or len(raid.participants) == 0:
+            return
+
+        _LOGGER.info("Remind the {} participants of raid {}".format(len(raid.participants), code))
+
+        # Each chat of the raid is reminded with a reply to its message
+        for target_chat_id, target_message_id in [(chat_id, self._raids.message(chat_id, code)),
+                                                  *self._mirrors_of(chat_id, code).items()]:
+            if target_message_id is None:
+                continue
+
+            for text in raid.to_reminder_msgs(minutes):
+                future = self._outbound.submit(Priority.REMINDER, target_chat_id, self._bot.send_message,
+                                               target_chat_id, text, parse_mode=ParseMode.MARKDOWN_V2,
+                                               disable_web_page_preview=True, reply_to_message_id=target_message_id)
+                future.add_done_callback(functools.partial(self._log_reminder_error, code))
+
+    @staticmethod
+    def _log_reminder_error(code: str, future: Future) -> None:
+        if future.exception() is not None:
+            _LOGGER.warning("Unable to remind raid {}: {}".format(code, future.exception()))
+
+    def _handler_dedup(self, update: Update, _: CallbackContext) -> None:
+        if not self._cluster.is_first_delivery(update):
+            _LOGGER.debug("Update {} was already processed".format(update.update_id))
+            raise DispatcherHandlerStop
 
     def _handler_error(self, update: Update, context: CallbackContext) -> None:
         _LOGGER.warning('Update "{}" caused error "{}"'.format(update, context.error))
 
+    @Decorator.RunAsync
     @Decorator.ChatMustBeEnabled
     def _handler_event_pinned(self, update: Update, _: CallbackContext) -> bool:
+        # Track the pinned message of the chat, whoever pinned it
+        self._raids.pin(update.message.chat.id, update.message.pinned_message.message_id)
+
         # Check if the pin is caused by the bot
         if update.message.from_user.id != self._id:
             return False
 
         # Remove the notify message
-        self._bot.delete_message(update.message.chat.id, update.message.message_id)
+        self._try_to_delete(update.message)
 
         return True
 
+    def _handler_event_members(self, update: Update, _: CallbackContext) -> None:
+        # An administrator may have joined or left, the list is fetched again on the next check
+        self._admins.invalidate(update.message.chat.id)
+
+    @Decorator.RunAsync
     @Decorator.ChatMustBeEnabled
     def _handler_screenshot(self, update: Update, _: CallbackContext) -> bool:
         _LOGGER.info("New image is arrived from {} by {}"
                      .format(update.effective_chat.title, update.effective_user.username))
 
         # Check if scan is disabled for this group
-        if self._redis.exists(update.effective_chat.id):
+        if self._config.contains(redis_keys.DISABLEDSCAN, update.effective_chat.id):
             _LOGGER.info("Screenshots scan for chat {} is disabled".format(update.effective_chat.id))
             return False
 
+        # The screenshots of an album are scanned together
+        if update.message.media_group_id is not None:
+            self._albums.add(update.message)
+            return True
+
         # Scan the screenshot
-        self._scan_screenshot(update.message)
+        self._submit_scan(update.message)
         return True
 
+    @Decorator.RunAsync
     @Decorator.ChatMustBeEnabled
     def _handler_set_hangout(self, update: Update, _: CallbackContext) -> bool:
         # Check if the reply is for the bot
@@ -241,10 +542,8 @@ class PoGORaidBot:
             return False
 
         try:
-            # Search the code in the bot message
-            code = re.search(r"\[([a-zA-Z0-9]{8})\]", update.message.reply_to_message.text).group(1)
-            # Try to retrieve the raid information
-            raid = pickle.loads(self._redis.get(redis_keys.RAID.format(code)))
+            # Find and retrieve the raid of the bot message
+            chat_id, raid = self._get_raid_of_message(update.message.reply_to_message)
         except Exception:  # TODO: improve except
             traceback.print_exc()
             _LOGGER.warning("A invalid to bot message reply was come")
@@ -254,63 +553,80 @@ class PoGORaidBot:
 
         # Find the new hangout
         result = re.search(r"([0-2]?[0-9])[:.,]([0-5]?[0-9])", update.message.text)
+        # The message moves to the bottom of the chat only when the hangout is set the first time
+        move = raid.hangout is None
         # Set new hangout
         raid.hangout = datetime.time(int(result.group(1)), int(result.group(2)))
 
         _LOGGER.debug(raid)
 
-        # Save the raid in the db
-        self._redis.setex(redis_keys.RAID.format(raid.code), 60 * 60 * 6, pickle.dumps(raid))
+        # Save the hangout in the db and updates the message with a single write
+        with self._raids.batch() as pipe:
+            self._raids.save_fields(chat_id, raid, "hangout", pipe=pipe)
+            self._reminders.schedule(chat_id, raid, pipe=pipe)
 
-        # Try to delete user message
-        self._try_to_delete(update.message)
+            self._post_raid(chat_id, raid, update.message.reply_to_message, pipe, move)
 
-        # Updates the message
-        self._post_raid(raid, update.message.reply_to_message)
+            # Try to delete user message, a failed post keeps it
+            self._try_to_delete(update.message)
 
         return True
 
+    @Decorator.RunAsync
     @Decorator.ChatMustBeEnabled
     def _handler_buttons(self, update: Update, _: CallbackContext) -> bool:
         try:
             # Validate the data
-            result = re.match(r"([a-zA-Z0-9]{8}):([arhifs])", update.callback_query.data)
-            # Try to retrieve the raid information
-            raid = pickle.loads(self._redis.get(redis_keys.RAID.format(result.group(1))))
+            result = re.match(r"([a-zA-Z0-9]{8}):([arhifs])(?::(-?[0-9]+))?", update.callback_query.data)
+            # Get the raid code
+            code = result.group(1)
             # Get operation
             op = result.group(2)
+            # Get the chat of the raid, a mirror has it in the data
+            chat_id = int(result.group(3)) if result.group(3) is not None else update.effective_chat.id
         except Exception:  # TODO: improve except
             _LOGGER.warning("A invalid callback query was come")
             return False
 
+        # A button can change the raid of another chat only from one of its mirrors
+        if chat_id != update.effective_chat.id and \
+                not self._config.contains(redis_keys.MIRROR, (chat_id, update.effective_chat.id)):
+            _LOGGER.warning("A callback query for chat {} was come from chat {}, that isn't its mirror"
+                            .format(chat_id, update.effective_chat.id))
+            return False
+
         _LOGGER.info("A callback query was come")
 
-        # Edit list of participants
-        if op == "a":
-            raid.add_participant(update.callback_query.from_user)
-        elif op == "r":
-            raid.remove_participant(update.callback_query.from_user)
-        elif op == "h":
-            raid.toggle_remote(update.callback_query.from_user)
-        elif op == "i":
-            raid.toggle_remote_invite(update.callback_query.from_user)
-        elif op == "f":
-            raid.toggle_flyer(update.callback_query.from_user)
-        elif op == "s":
-            raid.toggle_ready(update.callback_query.from_user)
-        else:
+        operations = {
+            "a": self._raids.add_participant,
+            "r": self._raids.remove_participant,
+            "h": self._raids.toggle_remote,
+            "i": self._raids.toggle_remote_invite,
+            "f": self._raids.toggle_flyer,
+            "s": self._raids.toggle_ready,
+        }
+
+        try:
+            # Edit list of participants directly in the db
+            raid = operations[op](chat_id, code, update.callback_query.from_user)
+        except DuplicateOperation:
+            _LOGGER.info("A double tap on a button was dropped")
+            return False
+        except (RaidNotFound, InvalidRaidData):
+            _LOGGER.warning("A callback query for a unknown raid was come")
             return False
 
         _LOGGER.debug(raid)
 
-        # Save the raid in the db
-        self._redis.setex(redis_keys.RAID.format(raid.code), 60 * 60 * 6, pickle.dumps(raid))
-
-        # Updates the message
-        self._post_raid(raid, update.callback_query.message)
+        # Updates the message, a burst of presses is shown with a single edit
+        if chat_id == update.effective_chat.id:
+            self._update_raid(chat_id, update.callback_query.message.message_id, raid)
+        else:
+            self._update_raid(chat_id, self._raids.message(chat_id, code), raid)
 
         return True
 
+    @Decorator.RunAsync
     @Decorator.ChatMustBeEnabled
     def _handler_set_boss(self, update: Update, _: CallbackContext) -> bool:
         # Check if the reply is for the bot
@@ -318,10 +634,8 @@ class PoGORaidBot:
             return False
 
         try:
-            # Search the code in the bot message
-            code = re.search(r"\[([a-zA-Z0-9]{8})\]", update.message.reply_to_message.text).group(1)
-            # Try to retrieve the raid information
-            raid = pickle.loads(self._redis.get(redis_keys.RAID.format(code)))
+            # Find and retrieve the raid of the bot message
+            chat_id, raid = self._get_raid_of_message(update.message.reply_to_message)
         except Exception:  # TODO: improve except
             _LOGGER.warning("A invalid to bot message reply was come")
             return False
@@ -340,7 +654,7 @@ class PoGORaidBot:
 
         # If the boss wasn't found reply with an error
         if b is None:
-            update.message.reply_markdown("Sorry, but i don't know *{}*".format(name))
+            self._reply(update.message, update.message.reply_markdown, "Sorry, but i don't know *{}*".format(name))
             _LOGGER.info("A valid boss wasn't found")
             return False
 
@@ -349,30 +663,31 @@ class PoGORaidBot:
         # Set the new boss
         raid.boss = b
 
-        # Save the raid in the db
-        self._save_raid(raid)
-
         _LOGGER.debug(raid)
 
-        # Try to delete user message
-        self._try_to_delete(update.message)
+        # Save the boss in the db and updates the message with a single write
+        with self._raids.batch() as pipe:
+            self._raids.save_fields(chat_id, raid, "boss", pipe=pipe)
 
-        # Updates the message
-        self._post_raid(raid, update.message.reply_to_message)
+            self._post_raid(chat_id, raid, update.message.reply_to_message, pipe)
+
+            # Try to delete user message, a failed post keeps it
+            self._try_to_delete(update.message)
 
         return True
 
     def _handler_command_about(self, update: Update, _: CallbackContext) -> None:
-        update.message.chat.send_message(about.MESSAGE, parse_mode=ParseMode.MARKDOWN_V2)
+        self._reply(update.message, update.message.chat.send_message, about.MESSAGE,
+                    parse_mode=ParseMode.MARKDOWN_V2)
 
     @Decorator.ChatMustBeEnabled
     @Decorator.UserMustBeAdmin
     def _handler_command_disablescan(self, update: Update, _: CallbackContext) -> bool:
         # Add current chat to the db of disabled scan
-        self._redis.sadd(redis_keys.DISABLEDSCAN, update.message.chat.id)
+        self._config.add(redis_keys.DISABLEDSCAN, update.message.chat.id)
 
         _LOGGER.info("Disable scan for chat {}".format(update.message.chat.id))
-        update.message.chat.send_message("The scan now is disabled")
+        self._reply(update.message, update.message.chat.send_message, "The scan now is disabled")
 
         return True
 
@@ -380,10 +695,10 @@ class PoGORaidBot:
     @Decorator.UserMustBeAdmin
     def _handler_command_enablescan(self, update: Update, _: CallbackContext) -> bool:
         # Remove current chat from the db of disabled scan
-        self._redis.srem(redis_keys.DISABLEDSCAN, update.message.chat.id)
+        self._config.remove(redis_keys.DISABLEDSCAN, update.message.chat.id)
 
         _LOGGER.info("Enable scan for chat {}".format(update.message.chat.id))
-        update.message.chat.send_message("The scan now is enabled")
+        self._reply(update.message, update.message.chat.send_message, "The scan now is enabled")
 
         return True
 
@@ -393,19 +708,15 @@ class PoGORaidBot:
 
         # Check if it is a reply to screenshot
         if update.message.reply_to_message is None or len(update.message.reply_to_message.photo) == 0:
-            update.message.reply_text("It must be a reply to a screenshot")
+            self._reply(update.message, update.message.reply_text, "It must be a reply to a screenshot")
             _LOGGER.info("Invalid scan command")
             return False
 
         # Try to delete user command
         self._try_to_delete(update.message)
 
-        try:
-            # Scan the screenshot
-            self._scan_screenshot(update.message.reply_to_message)
-        except:  # TODO: remove debug code
-            traceback.print_exc()
-            return False
+        # Scan the screenshot
+        self._submit_scan(update.message.reply_to_message)
 
         return True
 
@@ -415,19 +726,21 @@ class PoGORaidBot:
                                                                  update.message.reply_to_message.from_user.id))
 
         # Check if the cited user is already a bot admin
-        if self._redis.sismember(redis_keys.ADMIN, update.message.reply_to_message.from_user.id):
+        if self._config.contains(redis_keys.ADMIN, update.message.reply_to_message.from_user.id):
             _LOGGER.info("User {} is already a bot admin".format(update.message.reply_to_message.from_user.id))
-            update.message.reply_markdown("[{}](tg://user?id={}) is already a bot admin"
-                                          .format(update.message.reply_to_message.from_user.username,
-                                                  update.message.reply_to_message.from_user.id))
+            self._reply(update.message, update.message.reply_markdown,
+                        "[{}](tg://user?id={}) is already a bot admin"
+                        .format(update.message.reply_to_message.from_user.username,
+                                update.message.reply_to_message.from_user.id))
             return False
 
         # Add cited user as bot admin
-        self._redis.sadd(redis_keys.ADMIN, update.message.reply_to_message.from_user.id)
+        self._config.add(redis_keys.ADMIN, update.message.reply_to_message.from_user.id)
         _LOGGER.info("User {} is now a bot admin".format(update.message.reply_to_message.from_user.id))
-        update.message.reply_markdown("[{}](tg://user?id={}) is now a bot admin"
-                                      .format(update.message.reply_to_message.from_user.username,
-                                              update.message.reply_to_message.from_user.id))
+        self._reply(update.message, update.message.reply_markdown,
+                    "[{}](tg://user?id={}) is now a bot admin"
+                    .format(update.message.reply_to_message.from_user.username,
+                            update.message.reply_to_message.from_user.id))
 
         return True
 
@@ -439,25 +752,28 @@ class PoGORaidBot:
         # Check if the mentioned user is the superadmin
         if self._redis.get(redis_keys.SUPERADMIN) == update.message.reply_to_message.from_user.id:
             _LOGGER.info("User {} is the superadmin".format(update.message.reply_to_message.from_user.id))
-            update.message.reply_markdown("[{}](tg://user?id={}) is the superadmin and it cannot be removed"
-                                          .format(update.message.reply_to_message.from_user.username,
-                                                  update.message.reply_to_message.from_user.id))
+            self._reply(update.message, update.message.reply_markdown,
+                        "[{}](tg://user?id={}) is the superadmin and it cannot be removed"
+                        .format(update.message.reply_to_message.from_user.username,
+                                update.message.reply_to_message.from_user.id))
             return False
 
         # Check if the cited user is not a bot admin
-        if not self._redis.sismember(redis_keys.ADMIN, update.message.reply_to_message.from_user.id):
+        if not self._config.contains(redis_keys.ADMIN, update.message.reply_to_message.from_user.id):
             _LOGGER.info("User {} is not a bot admin".format(update.message.reply_to_message.from_user.id))
-            update.message.reply_markdown("[{}](tg://user?id={}) is not a bot admin"
-                                          .format(update.message.reply_to_message.from_user.username,
-                                                  update.message.reply_to_message.from_user.id))
+            self._reply(update.message, update.message.reply_markdown,
+                        "[{}](tg://user?id={}) is not a bot admin"
+                        .format(update.message.reply_to_message.from_user.username,
+                                update.message.reply_to_message.from_user.id))
             return False
 
         # Remove cited user as bot admin
-        self._redis.srem(redis_keys.ADMIN, update.message.reply_to_message.from_user.id)
+        self._config.remove(redis_keys.ADMIN, update.message.reply_to_message.from_user.id)
         _LOGGER.info("User {} is no longer a bot admin".format(update.message.reply_to_message.from_user.id))
-        update.message.reply_markdown("[{}](tg://user?id={}) is no longer a bot admin"
-                                      .format(update.message.reply_to_message.from_user.username,
-                                              update.message.reply_to_message.from_user.id))
+        self._reply(update.message, update.message.reply_markdown,
+                    "[{}](tg://user?id={}) is no longer a bot admin"
+                    .format(update.message.reply_to_message.from_user.username,
+                            update.message.reply_to_message.from_user.id))
 
         return True
 
@@ -467,15 +783,15 @@ class PoGORaidBot:
                                                                      update.message.chat.id))
 
         # Check if this chat is already enabled
-        if self._redis.sismember(redis_keys.ENABLEDCHAT, update.message.chat.id):
+        if self._config.contains(redis_keys.ENABLEDCHAT, update.message.chat.id):
             _LOGGER.info("Chat {} is already enabled".format(update.message.chat.id))
-            update.message.reply_markdown("This chat is already enabled")
+            self._reply(update.message, update.message.reply_markdown, "This chat is already enabled")
             return False
 
         # Add this chat to the enabled
-        self._redis.sadd(redis_keys.ENABLEDCHAT, update.message.chat.id)
+        self._config.add(redis_keys.ENABLEDCHAT, update.message.chat.id)
         _LOGGER.info("Chat {} is now enabled".format(update.message.chat.id))
-        update.message.reply_markdown("This chat is now enabled")
+        self._reply(update.message, update.message.reply_markdown, "This chat is now enabled")
 
         return True
 
@@ -485,18 +801,79 @@ class PoGORaidBot:
                                                                       update.message.chat.id))
 
         # Check if this chat is not enabled
-        if not self._redis.sismember(redis_keys.ENABLEDCHAT, update.message.chat.id):
+        if not self._config.contains(redis_keys.ENABLEDCHAT, update.message.chat.id):
             _LOGGER.info("Chat {} is not enabled".format(update.message.chat.id))
-            update.message.reply_markdown("This chat is not enabled")
+            self._reply(update.message, update.message.reply_markdown, "This chat is not enabled")
             return False
 
         # Remove this chat to the enabled
-        self._redis.srem(redis_keys.ENABLEDCHAT, update.message.chat.id)
+        self._config.remove(redis_keys.ENABLEDCHAT, update.message.chat.id)
         _LOGGER.info("Chat {} is no longer enabled".format(update.message.chat.id))
-        update.message.reply_markdown("This chat is no longer enabled")
+        self._reply(update.message, update.message.reply_markdown, "This chat is no longer enabled")
+
+        return True
+
+    @Decorator.ChatMustBeEnabled
+    @Decorator.UserMustBeBotAdmin
+    def _handler_command_mirror(self, update: Update, context: CallbackContext) -> bool:
+        _LOGGER.info("Bot admin {} try to mirror the raids of chat {}".format(update.message.from_user.id,
+                                                                             update.message.chat.id))
+
+        mirror_chat_id = self._get_chat_from_args(update, context)
+        if mirror_chat_id is None:
+            return False
+
+        # Check if the raids are already mirrored to the chat
+        if not self._config.add(redis_keys.MIRROR, (update.message.chat.id, mirror_chat_id)):
+            self._reply(update.message, update.message.reply_markdown,
+                        "The raids are already mirrored to chat `{}`".format(mirror_chat_id))
+            return False
+
+        _LOGGER.info("The raids of chat {} are now mirrored to chat {}".format(update.message.chat.id,
+                                                                               mirror_chat_id))
+        self._reply(update.message, update.message.reply_markdown,
+                    "The raids are now mirrored to chat `{}`".format(mirror_chat_id))
 
         return True
 
+    @Decorator.ChatMustBeEnabled
+    @Decorator.UserMustBeBotAdmin
+    def _handler_command_unmirror(self, update: Update, context: CallbackContext) -> bool:
+        _LOGGER.info("Bot admin {} try to unmirror the raids of chat {}".format(update.message.from_user.id,
+                                                                               update.message.chat.id))
+
+        mirror_chat_id = self._get_chat_from_args(update, context)
+        if mirror_chat_id is None:
+            return False
+
+        # Check if the raids are mirrored to the chat
+        if not self._config.remove(redis_keys.MIRROR, (update.message.chat.id, mirror_chat_id)):
+            self._reply(update.message, update.message.reply_markdown,
+                        "The raids are not mirrored to chat `{}`".format(mirror_chat_id))
+            return False
+
+        _LOGGER.info("The raids of chat {} are no longer mirrored to chat {}".format(update.message.chat.id,
+                                                                                     mirror_chat_id))
+        self._reply(update.message, update.message.reply_markdown,
+                    "The raids are no longer mirrored to chat `{}`".format(mirror_chat_id))
+
+        return True
+
+    def _get_chat_from_args(self, update: Update, context: CallbackContext) -> Union[int, None]:
+        # The chat is the argument of the command, it must be another enabled chat
+        try:
+            chat_id = int(context.args[0])
+        except (IndexError, ValueError):
+            self._reply(update.message, update.message.reply_markdown, "The id of a chat is required")
+            return None
+
+        if chat_id == update.message.chat.id or not self._config.contains(redis_keys.ENABLEDCHAT, chat_id):
+            self._reply(update.message, update.message.reply_markdown, "Chat `{}` is not enabled".format(chat_id))
+            return None
+
+        return chat_id
+
+    @Decorator.RunAsync
     def _handler_command_check(self, update: Update, _: CallbackContext) -> bool:
         _LOGGER.info("{} try to enable check from chat {}".format(update.message.from_user.id,
                                                                   update.message.chat.id))
@@ -507,48 +884,126 @@ class PoGORaidBot:
 
         # Try to retrieve the raid from reply
         try:
-            raid = self._get_raid_from_reply(update)
-        except ImpossibleRetrieveRaidFromReply:
+            chat_id, raid = self._get_raid_from_reply(update)
+        except (ImpossibleRetrieveRaidFromReply, ImpossibleRetrieveRaidFromDB):
             return False
 
         # Set the flag for check
         raid.is_check_enabled = True
 
-        # Save the raid to db
-        self._save_raid(raid)
+        # Save the flag to db and updates the message with a single write
+        with self._raids.batch() as pipe:
+            self._raids.save_fields(chat_id, raid, "is_check_enabled", pipe=pipe)
 
-        # Try to delete user message
-        self._try_to_delete(update.message)
+            self._post_raid(chat_id, raid, update.message.reply_to_message, pipe)
 
-        # Updates the message
-        self._post_raid(raid, update.message.reply_to_message)
+            # Try to delete user message, a failed post keeps it
+            self._try_to_delete(update.message)
 
         return True
 
+    def _submit_scan(self, message: Message) -> Future:
+        # Queue the screenshot in the scan pool
+        future = self._scan_executor.submit(self._scan_screenshot, message)
+
+        # Log the errors of the scan, otherwise they would be lost in the future
+        future.add_done_callback(self._handler_scan_done)
+
+        return future
+
+    @staticmethod
+    def _handler_scan_done(future: Future) -> None:
+        if future.exception() is not None:
+            _LOGGER.error("Scan failed", exc_info=future.exception())
+
     def _scan_screenshot(self, message: Message) -> None:
+        result = self._analyze_screenshot(message)
+
+        if result is not None:
+            with self._round_trips.measure("_scan_screenshot"):
+                self._publish_scan(message, *result)
+
+    def _scan_album(self, messages: List[Message]) -> None:
+        # Download and analyze all the screenshots in parallel
+        futures = [self._scan_executor.submit(self._analyze_screenshot, m) for m in messages]
+
+        results = []
+        identities = {}
+
+        for message, future in zip(messages, futures):
+            try:
+                result = future.result()
+            except Exception:
+                _LOGGER.exception("Scan of an album screenshot failed")
+                continue
+
+            if result is None:
+                continue
+
+            # Merge the screenshots of the same raid into the first one, a raid without gym or end can't be recognized
+            identity = result[1].identity
+            if None not in identity:
+                if identity in identities:
+                    raid = identities[identity]
+                    _LOGGER.info("Raid {} is a duplicate of raid {} in the album".format(result[1].code, raid.code))
+                    raid.merge(result[1])
+                    continue
+                identities[identity] = result[1]
+
+            results.append((message, *result))
+
+        _LOGGER.info("Album contains {} raids".format(len(results)))
+
+        # Post all the raids in a single burst
+        for message, screen, raid in results:
+            with self._round_trips.measure("_scan_album"):
+                self._publish_scan(message, screen, raid)
+
+    def _analyze_screenshot(self, message: Message) -> Union[Tuple[ScreenshotRaid, Raid], None]:
         # Get the highest resolution image
-        img = message.photo[-1].get_file().download_as_bytearray()
+        photo = message.photo[-1]
 
-        # Load the screenshot
-        screen = ScreenshotRaid(img)
+        # Reserve the memory of the decoded screenshot (BGR) before downloading it
+        with self._scan_memory.reserve(photo.width * photo.height * 3):
+            # Load the screenshot, the download buffer is reused as soon as it is decoded
+            with self._downloader.download(photo.get_file()) as img:
+                screen = ScreenshotRaid(img)
 
-        # Check if it's a screenshot of a raid
-        if not screen.is_raid:
-            return
+            # Check if it's a screenshot of a raid
+            if not screen.is_raid:
+                return None
 
-        _LOGGER.info("It's a valid screen of a raid")
+            _LOGGER.info("It's a valid screen of a raid")
 
-        # Get the raid dataclass
-        raid = screen.to_raid()
+            # Get the raid dataclass
+            raid = screen.to_raid()
 
-        # Save the raid in the db
-        self._redis.setex(redis_keys.RAID.format(raid.code), 60 * 60 * 6, pickle.dumps(raid))
+            # Drop the full image, all the sections are read
+            screen.release()
 
-        # Send reply
-        try:
-            self._post_raid(raid, message)
-        except:
-            traceback.print_exc()  # TODO: Remove this debug method
+            _LOGGER.info("Raid {} extracted from {:.1f} MiB of decoded pixels, peak of {:.1f} MiB in flight"
+                         .format(raid.code, screen.memory / 2 ** 20, self._scan_memory.peak / 2 ** 20))
+
+        return screen, raid
+
+    def _publish_scan(self, message: Message, screen: ScreenshotRaid, raid: Raid) -> None:
+        # Check if the raid was already posted in the chat
+        code = self._raids.claim(message.chat.id, raid)
+
+        if code != raid.code:
+            self._attach_scan(message, code, raid)
+
+        else:
+            # Save the raid in the db and send reply with a single write
+            try:
+                with self._raids.batch() as pipe:
+                    self._raids.save(message.chat.id, raid, pipe)
+                    self._post_raid(message.chat.id, raid, message, pipe)
+            except Exception:
+                _LOGGER.exception("Unable to post raid {}".format(raid.code))
+
+                # Nothing is saved and the next screenshot of the raid can post it
+                self._raids.release(message.chat.id, raid)
 
         # Save sections of image if it is required
         if self._debug_folder is not None:
@@ -566,28 +1021,74 @@ class PoGORaidBot:
             except PermissionError:
                 _LOGGER.warning("Unable to create debug folder")
 
-    def _get_raid_from_reply(self, update: Update) -> Raid:
+    def _attach_scan(self, message: Message, code: str, scan: Raid) -> None:
+        _LOGGER.info("Raid {} is a duplicate of raid {}".format(scan.code, code))
+
         try:
-            # Search the code in the bot message
-            code = re.search(r"\[([a-zA-Z0-9]{8})\]", update.message.reply_to_message.text).group(1)
-        except Exception:
-            _LOGGER.error("Bad raid post format")
+            raid = self._load_raid(message.chat.id, code)
+        except ImpossibleRetrieveRaidFromDB:
+            return
+
+        # Complete the existing raid with the new screenshot
+        changed = raid.merge(scan)
+        message_id = self._raids.message(message.chat.id, code)
+
+        # The raid is saved with its message, a raid without one lost its post and the screenshot posts it again
+        if message_id is None:
+            try:
+                with self._raids.batch() as pipe:
+                    self._raids.save_fields(message.chat.id, raid, *changed, pipe=pipe)
+                    self._post_raid(message.chat.id, raid, message, pipe)
+            except Exception:
+                _LOGGER.exception("Unable to post raid {}".format(raid.code))
+            return
+
+        if len(changed) == 0:
+            return
+
+        # Save the new fields and update the existing message with a single write
+        with self._raids.batch() as pipe:
+            self._raids.save_fields(message.chat.id, raid, *changed, pipe=pipe)
+            self._edit_raid(message.chat.id, message_id, raid, pipe)
+
+    def _get_raid_from_reply(self, update: Update) -> Tuple[int, Raid]:
+        # Find and retrieve the raid of the bot message
+        return self._get_raid_of_message(update.message.reply_to_message)
+
+    def _get_raid_of_message(self, message: Message) -> Tuple[int, Raid]:
+        # Returns the chat and the raid of the message, a mirror belongs to the raid of another chat
+        # The code in the text is read with the index of the messages, the ones posted before it have only that
+        result = re.search(r"\[([a-zA-Z0-9]{8})\]", message.text or "")
+
+        try:
+            return self._raids.load_by_message(message.chat.id, message.message_id,
+                                               result.group(1) if result is not None else None)
+        except (RaidNotFound, InvalidRaidData):
+            _LOGGER.error("Impossible to retrieve the raid of message {} from db".format(message.message_id))
             raise ImpossibleRetrieveRaidFromDB()
 
+    def _load_raid(self, chat_id: int, code: str) -> Raid:
         try:
-            # Try to retrieve the raid information
-            raid = pickle.loads(self._redis.get(redis_keys.RAID.format(code)))
-        except Exception:
+            return self._raids.load(chat_id, code)
+        except (RaidNotFound, InvalidRaidData):
             _LOGGER.error("Impossible to retrieve a raid with code {} from db".format(code))
             raise ImpossibleRetrieveRaidFromDB()
 
-        return raid
-
-    def _save_raid(self, raid: Raid):
-        # Save the raid in the db
-        self._redis.setex(redis_keys.RAID.format(raid.code), 60 * 60 * 6, pickle.dumps(raid))
+    def _post_raid(self, chat_id: int, raid: Raid, message: Message, pipe: Pipeline = None,
+                   move: bool = False) -> None:
+        # A mirror never moves, the raid is updated in its own chat and in all its mirrors
+        if message.chat.id != chat_id:
+            message_id = self._raids.message(chat_id, raid.code)
+            if message_id is not None:
+                self._edit_raid(chat_id, message_id, raid, pipe)
+
+        # A screenshot or a message that has to move gets a new message, the others are edited in place
+        elif message.from_user.id != self._id or move:
+            self._send_raid(raid, message, pipe)
+        else:
+            self._edit_raid(chat_id, message.message_id, raid, pipe)
 
-    def _post_raid(self, raid: Raid, message: Message) -> None:
+    def _send_raid(self, raid: Raid, message: Message, pipe: Pipeline = None) -> None:
         options = {
             "disable_web_page_preview": True,
             "parse_mode": ParseMode.MARKDOWN_V2
@@ -595,37 +1096,26 @@ class PoGORaidBot:
 
         # If the hangout is defined add the reply button to the message
         if raid.hangout is not None:
-            buttons = [
-                [
-                    InlineKeyboardButton("\U00002795", callback_data=raid.code + ":a"),
-                    InlineKeyboardButton("\U00002796", callback_data=raid.code + ":r")
-                ],
-                [
-                    InlineKeyboardButton("\U0001F3E1", callback_data=raid.code + ":h"),
-                    InlineKeyboardButton("\U0001F48C", callback_data=raid.code + ":i"),
-                    InlineKeyboardButton("\U00002708", callback_data=raid.code + ":f")
-                ]
-            ]
-
-            # If check is enable adds the "ready" button
-            if raid.is_check_enabled:
-                buttons.append([
-                    InlineKeyboardButton("ready", callback_data=raid.code + ":s")
-                ])
-
-            options["reply_markup"] = InlineKeyboardMarkup(buttons)
+            options["reply_markup"] = self._raid_markup(raid)
 
         # If the reference message is a screenshot, the bot replies to that
         elif message.from_user.id != self._id:
             options["reply_to_message_id"] = message.message_id
 
-        # TODO: improve this check method
-        # Check if the old message was pinned
-        try:
-            pinned = self._bot.get_chat(message.chat.id).pinned_message.message_id == message.message_id
-        except AttributeError:
-            pinned = False
+        # Check if the old message was pinned, only a tracked pin is confirmed because the unpins aren't notified
+        pinned = message.from_user.id == self._id and self._raids.pinned(message.chat.id) == message.message_id
+        if pinned:
+            try:
+                pinned = self._bot.get_chat(message.chat.id).pinned_message.message_id == message.message_id
+            except AttributeError:
+                pinned = False
 
+        # Send new message, its id is needed to track it
+        text = raid.to_msg()
+        new_msg = self._outbound.result(self._outbound.submit(Priority.POST, message.chat.id,
+                                                              message.chat.send_message, text, **options))
+
+        # The old messages are deleted only when the new one is sent
         # Try to delete the screenshot if it's necessary
         if message.reply_to_message is not None and raid.hangout is not None:
             self._try_to_delete(message.reply_to_message)
@@ -634,19 +1124,184 @@ class PoGORaidBot:
         if message.from_user.id == self._id:
             self._try_to_delete(message)
 
-        # Send new message
-        new_msg = message.chat.send_message(raid.to_msg(),
-                                            **options)
+        # Track the new message of the raid and what it shows
+        with self._raids.batch(pipe) as pipe:
+            # Re-pin the new message
+            if pinned:
+                self._outbound.submit(Priority.POST, message.chat.id, self._bot.pin_chat_message, message.chat.id,
+                                      new_msg.message_id, disable_notification=True)
+                self._raids.pin(message.chat.id, new_msg.message_id, pipe)
+
+            digest = self._render_digest(text, options.get("reply_markup"))
+            self._raids.track(message.chat.id, raid, new_msg.message_id, pipe)
+            self._raids.rendered(message.chat.id, raid, digest, pipe)
+
+            # The first post is mirrored to the linked chats, the mirrors of a moved message are edited
+            if message.from_user.id != self._id:
+                self._send_mirrors(message.chat.id, raid, text, pipe)
+            else:
+                self._edit_mirrors(message.chat.id, raid, text, digest)
+
+    def _send_mirrors(self, chat_id: int, raid: Raid, text: str, pipe: Pipeline = None) -> None:
+        links = self._config.mirrors(chat_id)
+        if len(links) == 0:
+            return
 
-        # Re-pin the new message
-        if pinned:
-            self._bot.pin_chat_message(message.chat.id, new_msg.message_id, disable_notification=True)
+        options = {
+            "disable_web_page_preview": True,
+            "parse_mode": ParseMode.MARKDOWN_V2,
+            "reply_markup": self._raid_markup(raid, chat_id)
+        }
+
+        # The mirrors are sent together, the queue spreads them within the limits of each chat
+        futures = {c: self._outbound.submit(Priority.POST, c, self._bot.send_message, c, text, **options)
+                   for c in links}
+
+        # The mirrors share the time the handler can wait
+        deadline = time.monotonic() + self._outbound.timeout
+
+        mirrors = {}
+        for mirror_chat_id, future in futures.items():
+            try:
+                mirrors[mirror_chat_id] = self._outbound.result(future, deadline - time.monotonic()).message_id
+            except (error.TelegramError, FutureTimeoutError) as e:
+                _LOGGER.warning("Unable to mirror raid {} to chat {}: {}".format(raid.code, mirror_chat_id, e))
+
+        if len(mirrors) > 0:
+            self._raids.track_mirrors(chat_id, raid, mirrors, pipe)
+
+    def _edit_raid(self, chat_id: int, message_id: Union[int, None], raid: Raid, pipe: Pipeline = None) -> None:
+        text = raid.to_msg()
+        markup = self._raid_markup(raid)
+
+        # Compare the render with the last one, the text and the keyboard are hashed apart
+        digest = self._render_digest(text, markup)
+        previous = self._raids.rendered(chat_id, raid, digest, pipe)
+
+        if previous == digest:
+            _LOGGER.debug("Raid {} is unchanged, the message isn't edited".format(raid.code))
+            return
+
+        # A change of the keyboard alone doesn't need to send the text again
+        only_markup = previous is not None and previous.split(":")[0] == digest.split(":")[0]
+
+        # The message of the raid may be unknown, e.g. when its index is expired, the mirrors are updated anyway
+        if message_id is not None:
+            self._submit_edit(chat_id, raid.code, digest, chat_id, message_id, text, markup, only_markup)
+
+        self._edit_mirrors(chat_id, raid, text, digest, only_markup)
+
+    def _edit_mirrors(self, chat_id: int, raid: Raid, text: str, digest: str, only_markup: bool = False) -> None:
+        mirrors = self._mirrors_of(chat_id, raid.code)
+        if len(mirrors) == 0:
+            return
+
+        # The render is reused by all the mirrors, their buttons differ only for the chat of the raid
+        markup = self._raid_markup(raid, chat_id)
+
+        for mirror_chat_id, message_id in mirrors.items():
+            self._submit_edit(chat_id, raid.code, digest, mirror_chat_id, message_id, text, markup, only_markup)
+
+    def _mirrors_of(self, chat_id: int, code: str) -> Dict[int, int]:
+        # Only the raids of a linked chat can have mirrors, the others don't need a lookup
+        links = self._config.mirrors(chat_id)
+        if len(links) == 0:
+            return {}
+
+        # A chat unlinked after the post keeps its message, but it isn't updated anymore
+        return {c: m for c, m in self._raids.mirrors(chat_id, code).items() if c in links}
+
+    def _submit_edit(self, raid_chat_id: int, code: str, digest: str, chat_id: int, message_id: int, text: str,
+                     markup: Union[InlineKeyboardMarkup, None], only_markup: bool) -> None:
+        if only_markup:
+            future = self._outbound.submit(Priority.EDIT, chat_id, self._bot.edit_message_reply_markup,
+                                           chat_id, message_id, reply_markup=markup)
+        else:
+            # A pending edit of the text is replaced by this one, that shows the latest render
+            future = self._outbound.submit(Priority.EDIT, chat_id, self._bot.edit_message_text, text,
+                                           chat_id, message_id, disable_web_page_preview=True,
+                                           parse_mode=ParseMode.MARKDOWN_V2, reply_markup=markup,
+                                           key=(chat_id, message_id))
+
+        future.add_done_callback(functools.partial(self._edit_done, raid_chat_id, code, digest))
+
+    def _edit_done(self, raid_chat_id: int, code: str, digest: str, future: Future) -> None:
+        e = future.exception()
+
+        # The message already shows this render
+        if e is None or isinstance(e, error.BadRequest) and "not modified" in e.message:
+            return
+
+        _LOGGER.warning("Unable to update raid {}: {}".format(code, e))
+
+        # The render wasn't shown, so the next one with the same content is sent again
+        self._raids.forget_render(raid_chat_id, code, digest)
+
+    def _update_raid(self, chat_id: int, message_id: int, raid: Raid) -> None:
+        # The changes of the raid in the window are shown when it closes
+        if self._renders.submit(chat_id, raid.code):
+            self._edit_raid(chat_id, message_id, raid)
+
+    def _flush_raid(self, chat_id: int, code: str) -> None:
+        # The message may have been moved during the window
+        message_id = self._raids.message(chat_id, code)
+        if message_id is None:
+            return
 
-    def _try_to_delete(self, message: Message):
         try:
-            self._bot.delete_message(message.chat.id, message.message_id)
-        except error.BadRequest:
+            raid = self._raids.load(chat_id, code)
+        except (RaidNotFound, InvalidRaidData):
+            return
+
+        self._update_raid(chat_id, message_id, raid)
+
+    @staticmethod
+    def _render_digest(text: str, markup: Union[InlineKeyboardMarkup, None]) -> str:
+        return ":".join(hashlib.blake2b(part.encode(), digest_size=8).hexdigest()
+                        for part in (text, markup.to_json() if markup is not None else ""))
+
+    @staticmethod
+    def _raid_markup(raid: Raid, chat_id: int = None) -> Union[InlineKeyboardMarkup, None]:
+        # The buttons are available only when the hangout is defined
+        if raid.hangout is None:
+            return None
+
+        # The buttons of a mirror carry the chat of the raid
+        suffix = ":{}".format(chat_id) if chat_id is not None else ""
+
+        buttons = [
+            [
+                InlineKeyboardButton("\U00002795", callback_data=raid.code + ":a" + suffix),
+                InlineKeyboardButton("\U00002796", callback_data=raid.code + ":r" + suffix)
+            ],
+            [
+                InlineKeyboardButton("\U0001F3E1", callback_data=raid.code + ":h" + suffix),
+                InlineKeyboardButton("\U0001F48C", callback_data=raid.code + ":i" + suffix),
+                InlineKeyboardButton("\U00002708", callback_data=raid.code + ":f" + suffix)
+            ]
+        ]
+
+        # If check is enable adds the "ready" button
+        if raid.is_check_enabled:
+            buttons.append([
+                InlineKeyboardButton("ready", callback_data=raid.code + ":s" + suffix)
+            ])
+
+        return InlineKeyboardMarkup(buttons)
+
+    def _try_to_delete(self, message: Message):
+        future = self._outbound.submit(Priority.DELETE, message.chat.id, self._bot.delete_message,
+                                       message.chat.id, message.message_id)
+        future.add_done_callback(self._log_delete_error)
+
+    @staticmethod
+    def _log_delete_error(future: Future) -> None:
+        if isinstance(future.exception(), error.BadRequest):
             _LOGGER.info("The bot hasn't the permission to delete messages")
 
+    def _reply(self, message: Message, func: Callable, *args, **kwargs) -> Future:
+        # The answers to the users come after the raids
+        return self._outbound.submit(Priority.REPLY, message.chat.id, func, *args, **kwargs)
+
     def _init_db(self):
         pass
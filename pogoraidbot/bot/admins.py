@@ -0,0 +1,53 @@
+from __future__ import annotations
+
+import logging
+import time
+from threading import Lock
+from typing import Dict, FrozenSet, Tuple
+
+from telegram import Bot
+
+_LOGGER = logging.getLogger(__package__)
+
+
+class AdminCache:
+    def __init__(self, bot: Bot, expiration: int = 60 * 10, refresh: int = 60):
+        self._bot = bot
+        # Time after which the administrators of a chat are fetched again
+        self._expiration = expiration
+        # Minimum age of the list before an unknown user causes a new fetch, e.g. a user just promoted
+        self._refresh = refresh
+
+        # Each list is replaced as a whole with the time it was fetched
+        self._chats: Dict[int, Tuple[float, FrozenSet[int]]] = {}
+        self._locks: Dict[int, Lock] = {}
+        self._lock = Lock()
+
+    def is_admin(self, chat_id: int, user_id: int) -> bool:
+        fetched, admins = self._chats.get(chat_id, (0.0, frozenset()))
+        age = time.monotonic() - fetched
+
+        if age < self._expiration and (user_id in admins or age < self._refresh):
+            return user_id in admins
+
+        return user_id in self._fetch(chat_id, fetched)
+
+    def invalidate(self, chat_id: int) -> None:
+        self._chats.pop(chat_id, None)
+
+    def _fetch(self, chat_id: int, fetched: float) -> FrozenSet[int]:
+        with self._lock:
+            lock = self._locks.setdefault(chat_id, Lock())
+
+        # A single request for each chat, the others wait for its list
+        with lock:
+            current = self._chats.get(chat_id)
+            if current is not None and current[0] > fetched:
+                return current[1]
+
+            admins = frozenset(a.user.id for a in self._bot.get_chat_administrators(chat_id))
+            self._chats[chat_id] = (time.monotonic(), admins)
+
+        _LOGGER.debug("{} administrators of chat {} are cached".format(len(admins), chat_id))
+
+        return admins
@@ -0,0 +1,40 @@
+from __future__ import annotations
+
+import logging
+from threading import Lock, Timer
+from typing import Callable, Dict, List, Tuple
+
+from telegram import Message
+
+_LOGGER = logging.getLogger(__package__)
+
+
+class AlbumCollector:
+    def __init__(self, flush: Callable[[List[Message]], None], window: float = 1.5):
+        self._flush = flush
+        self._window = window
+
+        self._albums: Dict[Tuple[int, str], List[Message]] = {}
+        self._lock = Lock()
+
+    def add(self, message: Message) -> None:
+        key = (message.chat_id, message.media_group_id)
+
+        with self._lock:
+            # The first photo of an album opens the window
+            if key not in self._albums:
+                self._albums[key] = []
+
+                timer = Timer(self._window, self._close, args=[key])
+                timer.daemon = True
+                timer.start()
+
+            self._albums[key].append(message)
+
+    def _close(self, key: Tuple[int, str]) -> None:
+        with self._lock:
+            messages = self._albums.pop(key)
+
+        _LOGGER.info("Album {} of chat {} is closed with {} photos".format(key[1], key[0], len(messages)))
+
+        self._flush(sorted(messages, key=lambda m: m.message_id))
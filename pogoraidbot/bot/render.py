@@ -0,0 +1,47 @@
+from __future__ import annotations
+
+import logging
+from threading import Lock, Timer
+from typing import Callable, Dict, Tuple
+
+_LOGGER = logging.getLogger(__package__)
+
+
+class RenderCoalescer:
+    def __init__(self, flush: Callable[[int, str], None], window: float = 1.0):
+        self._flush = flush
+        self._window = window
+
+        # Raids with an open window, flagged if they changed after the render that opened it
+        self._windows: Dict[Tuple[int, str], bool] = {}
+        self._lock = Lock()
+
+    def submit(self, chat_id: int, code: str) -> bool:
+        # Returns whether the raid has to be rendered now, otherwise it is rendered at the end of the window
+        key = (chat_id, code)
+
+        with self._lock:
+            if key in self._windows:
+                self._windows[key] = True
+                return False
+
+            # The first change renders immediately and opens the window
+            self._windows[key] = False
+
+            timer = Timer(self._window, self._close, args=[key])
+            timer.daemon = True
+            timer.start()
+
+        return True
+
+    def _close(self, key: Tuple[int, str]) -> None:
+        with self._lock:
+            changed = self._windows.pop(key)
+
+        if not changed:
+            return
+
+        _LOGGER.debug("Raid {} of chat {} changed during the window".format(key[1], key[0]))
+
+        # The last state of the raid shows all the changes of the window together
+        self._flush(*key)
@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+import functools
+import json
+import logging
+import os
+import socket
+import uuid
+from queue import Queue
+from threading import Event
+from typing import Callable
+
+from redis import StrictRedis
+from telegram import Bot, Update, error
+
+from .. import redis_keys
+
+_LOGGER = logging.getLogger(__package__)
+
+# Renews the lease only if this node is still the owner
+_RENEW_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("EXPIRE", KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# Releases the lease only if this node is still the owner
+_RELEASE_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
+
+
+class Cluster:
+    def __init__(self, redis: StrictRedis, is_enabled: bool = True, lease: int = 15,
+                 dedup_expiration: int = 60 * 60):
+        self._redis = redis
+        self._is_enabled = is_enabled
+        self._lease = lease
+        self._dedup_expiration = dedup_expiration
+
+        # Unique id of this replica
+        self.node_id = "{}:{}:{}".format(socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+
+        self._renew = self._redis.register_script(_RENEW_SCRIPT)
+        self._release = self._redis.register_script(_RELEASE_SCRIPT)
+
+        # A single instance is always the leader, it doesn't take the lease
+        self._is_leader = not is_enabled
+
+    @property
+    def is_leader(self) -> bool:
+        return self._is_leader
+
+    def heartbeat(self) -> bool:
+        if not self._is_enabled:
+            return True
+
+        # Try to renew the lease, otherwise try to acquire it
+        is_leader = bool(self._renew(keys=[redis_keys.LEADER], args=[self.node_id, self._lease])) \
+                    or bool(self._redis.set(redis_keys.LEADER, self.node_id, nx=True, ex=self._lease))
+
+        if is_leader != self._is_leader:
+            _LOGGER.info("Node {} is {} the leader".format(self.node_id, "now" if is_leader else "no longer"))
+
+        self._is_leader = is_leader
+
+        return self._is_leader
+
+    def release(self) -> None:
+        # Give up the lease on shutdown, so a restarted node or another replica takes it without waiting
+        if not self._is_enabled or not self._is_leader:
+            return
+
+        self._release(keys=[redis_keys.LEADER], args=[self.node_id])
+        self._is_leader = False
+
+        _LOGGER.info("Node {} released the leadership".format(self.node_id))
+
+    def leader_only(self, func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not self._is_leader:
+                _LOGGER.debug("Job {} skipped, this node is not the leader".format(func.__name__))
+                return None
+
+            return func(*args, **kwargs)
+
+        return wrapper
+
+    def is_first_delivery(self, update: Update) -> bool:
+        # Only the first replica that marks the update processes it
+        return bool(self._redis.set(redis_keys.UPDATE.format(update.update_id), self.node_id,
+                                    nx=True, ex=self._dedup_expiration))
+
+    def poll(self, bot: Bot, stop: Event, timeout: int = 10) -> None:
+        # Thread target, the leader pulls the updates from Telegram and fans them out through redis
+        was_leader = False
+
+        while not stop.is_set():
+            if not self._is_leader:
+                was_leader = False
+                stop.wait(1)
+                continue
+
+            try:
+                # The polling doesn't work if a webhook was set
+                if not was_leader:
+                    bot.delete_webhook()
+                    was_leader = True
+
+                offset = int(self._redis.get(redis_keys.UPDATES_OFFSET) or 0)
+
+                updates = bot.get_updates(offset=offset, timeout=timeout)
+            except error.TelegramError as e:
+                _LOGGER.warning("Unable to get the updates: {}".format(e))
+                stop.wait(1)
+                continue
+
+            if len(updates) == 0:
+                continue
+
+            pipe = self._redis.pipeline(transaction=False)
+            for u in updates:
+                pipe.rpush(redis_keys.UPDATES, u.to_json())
+            pipe.set(redis_keys.UPDATES_OFFSET, updates[-1].update_id + 1)
+            pipe.execute()
+
+            _LOGGER.debug("{} updates fanned out".format(len(updates)))
+
+    def consume(self, bot: Bot, update_queue: Queue, stop: Event, timeout: int = 1) -> None:
+        # Thread target, each replica takes the updates from the shared list
+        while not stop.is_set():
+            item = self._redis.blpop(redis_keys.UPDATES, timeout=timeout)
+
+            if item is None:
+                continue
+
+            update_queue.put(Update.de_json(json.loads(item[1]), bot))
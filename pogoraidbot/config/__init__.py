@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from typing import Dict, FrozenSet, Hashable, List, Tuple, Union
+
+from redis import StrictRedis, exceptions
+
+from .. import redis_keys
+
+_LOGGER = logging.getLogger(__package__)
+
+
+class ConfigCache:
+    # Sets of the configuration mirrored in memory
+    KEYS = (redis_keys.ENABLEDCHAT, redis_keys.ADMIN, redis_keys.DISABLEDSCAN, redis_keys.MIRROR)
+
+    def __init__(self, redis: StrictRedis):
+        self._redis = redis
+
+        # Each set is replaced as a whole, so the readers never need a lock
+        self._sets: Dict[str, FrozenSet[Hashable]] = {k: frozenset() for k in ConfigCache.KEYS}
+
+        self.reload()
+
+        # Keep the sets updated with the changes made by any replica
+        self._thread = threading.Thread(target=self._listen, name="config", daemon=True)
+        self._thread.start()
+
+    def contains(self, key: str, member: Union[int, Tuple[int, int]]) -> bool:
+        return self._decode(key, self._encode(member)) in self._sets[key]
+
+    def mirrors(self, chat_id: int) -> List[int]:
+        # Chats where the raids of the chat are mirrored
+        return sorted(mirror for origin, mirror in self._sets[redis_keys.MIRROR] if origin == chat_id)
+
+    def add(self, key: str, member: Union[int, Tuple[int, int]]) -> bool:
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.sadd(key, self._encode(member))
+        pipe.publish(redis_keys.CONFIG_CHANGES, key)
+        added, _ = pipe.execute()
+
+        self._sets[key] = self._sets[key] | {self._decode(key, self._encode(member))}
+
+        return bool(added)
+
+    def remove(self, key: str, member: Union[int, Tuple[int, int]]) -> bool:
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.srem(key, self._encode(member))
+        pipe.publish(redis_keys.CONFIG_CHANGES, key)
+        removed, _ = pipe.execute()
+
+        self._sets[key] = self._sets[key] - {self._decode(key, self._encode(member))}
+
+        return bool(removed)
+
+    def reload(self, *keys: str) -> None:
+        keys = keys if len(keys) > 0 else ConfigCache.KEYS
+
+        pipe = self._redis.pipeline(transaction=False)
+        for key in keys:
+            pipe.smembers(key)
+
+        for key, members in zip(keys, pipe.execute()):
+            self._sets[key] = frozenset(self._decode(key, m) for m in members)
+
+    def _listen(self) -> None:
+        while True:
+            pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+
+            try:
+                pubsub.subscribe(redis_keys.CONFIG_CHANGES)
+
+                # The changes missed while disconnected are recovered
+                self.reload()
+
+                for message in pubsub.listen():
+                    key = message["data"].decode()
+                    if key in self._sets:
+                        _LOGGER.debug("Config {} is changed".format(key))
+                        self.reload(key)
+
+            except exceptions.RedisError as e:
+                # Any error would leave the config stale, so it is subscribed and reloaded again
+                _LOGGER.warning("Listening for the config changes failed: {}".format(e))
+                time.sleep(1)
+
+            finally:
+                pubsub.close()
+
+    @staticmethod
+    def _encode(member: Union[int, Tuple[int, int]]) -> str:
+        # The links are stored as "origin:mirror"
+        return ":".join(str(m) for m in member) if isinstance(member, tuple) else str(member)
+
+    @staticmethod
+    def _decode(key: str, member: Union[str, bytes]) -> Hashable:
+        member = member.decode() if isinstance(member, bytes) else member
+
+        if key == redis_keys.MIRROR:
+            return tuple(int(m) for m in member.split(":"))
+
+        return int(member)
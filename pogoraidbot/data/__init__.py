@@ -1,4 +1,5 @@
 from .boss import Boss, BossesList
+from .data import Data, DataList
 from .gym import Gym, GymsList
 
 bosses = BossesList()
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import logging
+from collections import Counter
 from dataclasses import dataclass
 from difflib import SequenceMatcher
 from typing import List, Union
@@ -22,6 +23,7 @@ class DataList(List):
     def __init__(self):
         super(DataList, self).__init__()
         self._is_loaded = False
+        self._index = {}
 
     @property
     def is_loaded(self) -> bool:
@@ -30,24 +32,34 @@ class DataList(List):
     def load_from(self, file: str) -> bool:
         _LOGGER.info("Try to load {}".format(self.__class__.__name__))
 
+        raw = self.fetch(file)
+
+        if raw is None:
+            return False
+
+        return self.load(raw)
+
+    @staticmethod
+    def fetch(file: str) -> Union[str, None]:
         try:
             # Check if the resource is remote
             if bool(urlparse(file).scheme):
                 # Load the remote json
-                raw = requests.get(file).text
+                return requests.get(file).text
 
             else:
                 # Open the file and load it as json
                 with open(file, 'r') as f:
-                    raw = f.read()
+                    return f.read()
 
         except FileNotFoundError:
             _LOGGER.warning("Failed to load the list: file not found")
-            return False
+            return None
         except requests.exceptions.ConnectionError:
             _LOGGER.warning("Failed to load the list: an HTTP error occurred")
-            return False
+            return None
 
+    def load(self, raw: str) -> bool:
         try:
             self._load_json(raw)
             self._is_loaded = True
@@ -64,12 +76,19 @@ class DataList(List):
             _LOGGER.warning("The file is in a wrong format")
             return False
 
+        # Index the entities by name for the exact lookups, a name shared by more entities is ambiguous and left out
+        names = Counter(d.name for d in self)
+        self._index = {d.name: d for d in self if names[d.name] == 1}
+
         _LOGGER.debug(self)
 
         _LOGGER.info("{} is loaded with {} entities".format(self.__class__.__name__, len(self)))
 
         return True
 
+    def get(self, name: str) -> Union[Data, None]:
+        return self._index.get(name)
+
     def find(self, name: str, minimal_value: float = 0.4) -> Union[Data, None]:
         if not self.is_loaded:
             return None
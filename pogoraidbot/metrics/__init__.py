@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import logging
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+from redis import StrictRedis
+from redis.cluster import RedisCluster
+
+_LOGGER = logging.getLogger(__package__)
+
+
+class RoundTrips:
+    def __init__(self, limit: int = 2):
+        # Round trips expected at most for an update
+        self._limit = limit
+
+        # Each update is handled by a single thread
+        self._local = threading.local()
+
+        self._histogram = Counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def measure(self, name: str):
+        self._local.count = 0
+
+        try:
+            yield
+        finally:
+            count, self._local.count = self._local.count, None
+
+            with self._lock:
+                self._histogram[count] += 1
+
+            if count > self._limit:
+                _LOGGER.warning("{} took {} redis round trips".format(name, count))
+            else:
+                _LOGGER.debug("{} took {} redis round trips".format(name, count))
+
+    def count(self) -> None:
+        # Only the round trips made while handling an update are counted
+        if getattr(self._local, "count", None) is not None:
+            self._local.count += 1
+
+    def summary(self) -> str:
+        with self._lock:
+            histogram = sorted(self._histogram.items())
+
+        return ", ".join("{} updates with {} round trips".format(n, c) for c, n in histogram)
+
+
+class _CountingMixin:
+    # Redis client that reports each round trip to the meter
+    round_trips: RoundTrips = None
+
+    def execute_command(self, *args, **options):
+        if self.round_trips is not None:
+            self.round_trips.count()
+
+        return super(_CountingMixin, self).execute_command(*args, **options)
+
+    def pipeline(self, *args, **kwargs):
+        pipe = super(_CountingMixin, self).pipeline(*args, **kwargs)
+
+        if self.round_trips is not None:
+            execute = pipe.execute
+
+            # A pipeline is sent in a single round trip, an empty one isn't sent at all
+            def counted_execute(*a, **k):
+                if len(pipe.command_stack) > 0:
+                    self.round_trips.count()
+                return execute(*a, **k)
+
+            pipe.execute = counted_execute
+
+        return pipe
+
+
+class CountingRedis(_CountingMixin, StrictRedis):
+    pass
+
+
+class CountingRedisCluster(_CountingMixin, RedisCluster):
+    pass
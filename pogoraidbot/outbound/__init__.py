@@ -0,0 +1,255 @@
+from __future__ import annotations
+
+import bisect
+import itertools
+import logging
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, TimeoutError
+from enum import IntEnum
+from typing import Callable, Dict, Hashable, List, Tuple, Union
+
+from telegram import error
+
+_LOGGER = logging.getLogger(__package__)
+
+
+class Priority(IntEnum):
+    POST = 0
+    REMINDER = 1
+    EDIT = 2
+    DELETE = 3
+    REPLY = 4
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        # Tokens refilled each second
+        self._rate = rate
+        self._capacity = capacity
+
+        self._tokens = capacity
+        self._last = time.monotonic()
+        self._paused_until = 0.0
+
+    def wait(self, now: float) -> float:
+        # Seconds until a token is available
+        self._refill(now)
+
+        if now < self._paused_until:
+            return self._paused_until - now
+
+        return 0.0 if self._tokens >= 1 else (1 - self._tokens) / self._rate
+
+    def take(self) -> None:
+        self._tokens -= 1
+
+    def pause(self, until: float) -> None:
+        # Telegram asked to wait, after that the bucket restarts with a single token
+        self._paused_until = max(self._paused_until, until)
+        self._tokens = min(self._tokens, 1)
+
+    def is_full(self, now: float) -> bool:
+        # The bucket refills also while its chat is idle
+        self._refill(now)
+
+        return self._tokens >= self._capacity and now >= self._paused_until
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self._capacity, self._tokens + (now - self._last) * self._rate)
+        self._last = now
+
+
+class _Request:
+    def __init__(self, priority: Priority, chat_id: int, func: Callable, args: tuple, kwargs: dict,
+                 key: Hashable = None):
+        self.priority = priority
+        self.chat_id = chat_id
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.key = key
+        self.future = Future()
+        self.submitted = time.monotonic()
+
+
+class OutboundQueue:
+    def __init__(self, rate: float = 30, chat_rate: float = 20 / 60, chat_burst: int = 20, workers: int = 4,
+                 timeout: float = 15, eviction: float = 60):
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        # Interval between the evictions of the buckets of the idle chats
+        self._eviction = eviction
+        self._evicted = time.monotonic()
+        # Maximum time a handler waits for the result of a request
+        self._timeout = timeout
+
+        # The global limit of the bot and the limit of each chat
+        self._bucket = TokenBucket(rate, rate)
+        self._chats: Dict[int, TokenBucket] = {}
+
+        # Requests ordered by priority and then by arrival
+        self._pending: List[Tuple[int, int, _Request]] = []
+        self._keys: Dict[Hashable, _Request] = {}
+        self._seq = itertools.count()
+        self._condition = threading.Condition()
+
+        # Metrics of the queue
+        self._sent = Counter()
+        self._waited = Counter()
+        self._merged = 0
+        self._flood_waits = 0
+        self._peak = 0
+
+        for i in range(workers):
+            threading.Thread(target=self._work, name="outbound-{}".format(i), daemon=True).start()
+
+    def submit(self, priority: Priority, chat_id: int, func: Callable, *args,
+               key: Hashable = None, **kwargs) -> Future:
+        # A request with the key of a pending one replaces it, e.g. the edits of the same message
+        request = _Request(priority, chat_id, func, args, kwargs, key)
+
+        with self._condition:
+            if key is not None and key in self._keys:
+                old = self._keys[key]
+                self._pending.remove(next(p for p in self._pending if p[2] is old))
+                self._merged += 1
+
+                # Who waits for the old request gets the result of the new one
+                request.future.add_done_callback(lambda f: _chain(f, old.future))
+                request.submitted = old.submitted
+
+            if key is not None:
+                self._keys[key] = request
+
+            bisect.insort(self._pending, (priority, next(self._seq), request))
+            self._peak = max(self._peak, len(self._pending))
+            self._condition.notify()
+
+        return request.future
+
+    def result(self, future: Future, timeout: float = None):
+        # A handler doesn't wait a busy chat forever, a request not sent yet is dropped, one being sent is awaited
+        try:
+            return future.result(self._timeout if timeout is None else max(timeout, 0))
+        except TimeoutError:
+            if future.cancel():
+                raise
+
+            return future.result()
+
+    @property
+    def timeout(self) -> float:
+        return self._timeout
+
+    @property
+    def depth(self) -> int:
+        return len(self._pending)
+
+    def summary(self) -> str:
+        with self._condition:
+            sent = {p: (self._sent[p], self._waited[p] / self._sent[p]) for p in Priority if self._sent[p] > 0}
+
+            return "{} pending (peak {}), {}, {} merged, {} flood waits".format(
+                len(self._pending), self._peak,
+                ", ".join("{} {} sent in {:.2f}s on average".format(n, p.name.lower(), w)
+                          for p, (n, w) in sent.items()) or "nothing sent",
+                self._merged, self._flood_waits)
+
+    def _next(self, now: float) -> Tuple[Union[_Request, None], Union[float, None]]:
+        # Take the first request whose chat has a token, otherwise tell how long to wait
+        wait = self._bucket.wait(now)
+        if wait > 0:
+            return None, wait
+
+        # The requests dropped by their handler are forgotten
+        for p in [p for p in self._pending if p[2].future.cancelled()]:
+            self._pending.remove(p)
+            if p[2].key is not None and self._keys.get(p[2].key) is p[2]:
+                del self._keys[p[2].key]
+
+        wait = None
+        for i, (_, _, request) in enumerate(self._pending):
+            if request.chat_id not in self._chats:
+                self._chats[request.chat_id] = TokenBucket(self._chat_rate, self._chat_burst)
+
+            chat_wait = self._chats[request.chat_id].wait(now)
+            if chat_wait == 0:
+                del self._pending[i]
+                if request.key is not None and self._keys.get(request.key) is request:
+                    del self._keys[request.key]
+
+                self._bucket.take()
+                self._chats[request.chat_id].take()
+
+                return request, None
+
+            wait = chat_wait if wait is None else min(wait, chat_wait)
+
+        # The buckets of the idle chats are forgotten from time to time, a full one is the same as a new one
+        if now - self._evicted >= self._eviction:
+            self._chats = {c: b for c, b in self._chats.items() if not b.is_full(now)}
+            self._evicted = now
+
+        return None, wait
+
+    def _work(self) -> None:
+        while True:
+            with self._condition:
+                request, wait = self._next(time.monotonic())
+                while request is None:
+                    self._condition.wait(wait)
+                    request, wait = self._next(time.monotonic())
+
+            # The handler may drop the request until it starts, a request queued again is already started
+            if not request.future.running() and not request.future.set_running_or_notify_cancel():
+                continue
+
+            try:
+                result = request.func(*request.args, **request.kwargs)
+
+            except error.RetryAfter as e:
+                _LOGGER.warning("Flood limit reached in chat {}, retry in {}s".format(request.chat_id,
+                                                                                      e.retry_after))
+
+                # The chat waits as asked and the request is queued again, unless a newer one replaced it
+                with self._condition:
+                    self._flood_waits += 1
+                    self._chats.setdefault(request.chat_id, TokenBucket(self._chat_rate, self._chat_burst)) \
+                        .pause(time.monotonic() + e.retry_after)
+
+                    if request.key is not None and request.key in self._keys:
+                        request.future.set_result(None)
+                    else:
+                        if request.key is not None:
+                            self._keys[request.key] = request
+                        bisect.insort(self._pending, (request.priority, next(self._seq), request))
+                    self._condition.notify()
+                continue
+
+            except Exception as e:
+                _LOGGER.debug("Request {} to chat {} failed: {}"
+                              .format(getattr(request.func, "__name__", request.func), request.chat_id, e))
+                request.future.set_exception(e)
+
+            else:
+                request.future.set_result(result)
+
+            with self._condition:
+                self._sent[request.priority] += 1
+                self._waited[request.priority] += time.monotonic() - request.submitted
+
+
+def _chain(source: Future, target: Future) -> None:
+    if target.cancelled():
+        return
+
+    if source.cancelled():
+        target.cancel()
+        return
+
+    if source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
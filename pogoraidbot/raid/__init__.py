@@ -1,22 +1,71 @@
 from __future__ import annotations
 
+import dataclasses
 import datetime
 import random
 import string
+import time
 from dataclasses import dataclass, field
-from enum import Enum
-from functools import reduce
-from typing import Dict
+from enum import IntEnum
+from functools import lru_cache
+from typing import Callable, Dict, List, Tuple, Union
 
 from telegram import User
 from telegram.utils import helpers
 
 from ..data import Boss, Gym
 
+_CODE_CHARS = string.ascii_letters + string.digits
 
+
+def nearest_timestamp(t: datetime.time) -> float:
+    # The times of a raid are times of the day, each one is taken as the nearest one to now
+    now = datetime.datetime.now()
+
+    moment = datetime.datetime.combine(now.date(), t)
+    if moment - now > datetime.timedelta(hours=12):
+        moment -= datetime.timedelta(days=1)
+    elif now - moment > datetime.timedelta(hours=12):
+        moment += datetime.timedelta(days=1)
+
+    return moment.timestamp()
+
+
+def _slots(*extra: str) -> Callable[[type], type]:
+    # Same as dataclass(slots=True) of Python 3.10, the class is created again with a slot for each field
+    def wrap(cls: type) -> type:
+        names = tuple(f.name for f in dataclasses.fields(cls))
+        body = {k: v for k, v in cls.__dict__.items() if k not in names + ("__dict__", "__weakref__")}
+        body["__slots__"] = names + extra
+        body["__setstate__"] = _setstate
+
+        return type(cls)(cls.__name__, cls.__bases__, body)
+
+    return wrap
+
+
+def _setstate(self, state: Union[dict, tuple]) -> None:
+    # The raids pickled by the previous versions have the state of a class with a __dict__
+    if isinstance(state, tuple):
+        state = {**(state[0] or {}), **state[1]}
+
+    # Their missing fields took the default of the class, the factories are left to the loader
+    for f in dataclasses.fields(self):
+        if f.default is not dataclasses.MISSING:
+            setattr(self, f.name, f.default)
+
+    for name, value in state.items():
+        setattr(self, name, value)
+
+    if hasattr(self, "__post_init__"):
+        self.__post_init__()
+
+
+@_slots()
 @dataclass
 class Participant:
-    class Type(Enum):
+    # The types are small ints, as they are stored
+    class Type(IntEnum):
         NORMAL = 1
         REMOTE = 2
         REMOTE_INVITE = 3
@@ -27,6 +76,8 @@ class Participant:
     type: Type = Type.NORMAL
     number: int = 1
     is_ready: bool = False
+    # Milliseconds timestamp of the join, it keeps the order of the participants
+    joined: int = field(default_factory=lambda: int(time.time() * 1000))
 
     @property
     def is_remote(self) -> bool:
@@ -41,10 +92,10 @@ class Participant:
         return self.type == Participant.Type.FLYER
 
 
+@_slots("_count", "_ready")
 @dataclass
 class Raid:
-    code: str = field(
-        default_factory=lambda: "".join(random.choice(string.ascii_letters + string.digits) for i in range(8)))
+    code: str = field(default_factory=lambda: "".join(random.choices(_CODE_CHARS, k=8)))
     gym: Gym = None
     is_ex: bool = False
     level: int = None
@@ -57,12 +108,19 @@ class Raid:
     participants: Dict[int, Participant] = field(default_factory=lambda: {})
     is_check_enabled: bool = False
 
+    def __post_init__(self) -> None:
+        # The totals are computed once for each load, the bot changes the participants in redis and loads them again
+        # The operations on the participants keep them, so they are changed only through them
+        self._count = sum(p.number for p in self.participants.values())
+        self._ready = sum(1 for p in self.participants.values() if p.is_ready)
+
     def add_participant(self, user: User) -> None:
         if user.id in self.participants:
             self.participants[user.id].name = user.full_name
             self.participants[user.id].number += 1
         else:
             self.participants[user.id] = Participant(user.id, user.full_name)
+        self._count += 1
 
     def remove_participant(self, user: User) -> bool:
         if user.id in self.participants:
@@ -70,7 +128,9 @@ class Raid:
                 self.participants[user.id].name = user.full_name
                 self.participants[user.id].number -= 1
             else:
+                self._ready -= self.participants[user.id].is_ready
                 del self.participants[user.id]
+            self._count -= 1
             return True
         return False
 
@@ -96,14 +156,35 @@ class Raid:
             return False
 
         self.participants[user.id].is_ready = not self.participants[user.id].is_ready
+        self._ready += 1 if self.participants[user.id].is_ready else -1
+
+        return True
+
+    def merge(self, other: Raid) -> List[str]:
+        # Takes what another scan of the same raid knows better, the changed fields are returned
+        changed = []
+
+        if other.is_hatched and not self.is_hatched:
+            self.is_hatched = True
+            changed.append("is_hatched")
+
+        if other.boss is not None and self.boss is None:
+            self.boss = other.boss
+            changed.append("boss")
+
+        if self.is_aprx_time and not other.is_aprx_time:
+            self.end, self.hatching, self.is_aprx_time = other.end, other.hatching, False
+            changed += ["end", "hatching", "is_aprx_time"]
+
+        return changed
 
     @property
     def participants_count(self) -> int:
-        return reduce((lambda x, y: x + y), [p.number for _, p in self.participants.items()], 0)
+        return self._count
 
     @property
     def are_all_ready(self) -> bool:
-        return all([p.is_ready for _, p in self.participants.items()])
+        return self._ready == len(self.participants)
 
     @property
     def effective_level(self) -> int:
@@ -112,71 +193,106 @@ class Raid:
                 return self.boss.level
         return self.level
 
+    @property
+    def identity(self) -> Tuple[str, int, int]:
+        # Raids of the same gym with the same level and end time (in slots of 5 minutes) are the same raid
+        end = self.end.hour * 60 + self.end.minute if self.end is not None else None
+        return (self.gym.name if self.gym is not None else None,
+                self.effective_level,
+                round(end / 5) if end is not None else None)
+
     def to_msg(self) -> str:
-        msg = ""
+        # The fragments are cached by their content, so only the changed ones are escaped again
+        msg = _header(self.is_ex, self.gym.name, self.gym.map, self.boss.name if self.boss is not None else None,
+                      self.boss is not None and self.boss.is_there_shiny, self.effective_level)
+        msg += _times(self.hatching, self.end, self.hangout, self.is_aprx_time)
 
-        if self.is_ex:
-            msg += "*EX*"
+        if self._count > 0:
+            msg += _SEPARATOR
+            msg += "".join(_participant(p_id, p.name, p.type, p.number, self.is_check_enabled, p.is_ready)
+                           for p_id, p in self.participants.items())
+            msg += _SEPARATOR
 
-        if self.gym.latitude is not None and self.gym.longitude is not None:
-            msg += "[{}]({})".format(
-                helpers.escape_markdown(self.gym.name, version=2),
-                helpers.escape_markdown(self.gym.map, version=2))
-        else:
-            msg += "{}".format(helpers.escape_markdown(self.gym.name, version=2))
+            if self.is_check_enabled:
+                msg += "__*All participants are ready*__\n" if self.are_all_ready \
+                    else "__*Not all participants are ready*__\n"
 
-        msg += "\n\n"
+            msg += "*{}* participants\n".format(self._count)
 
-        if self.boss is not None:
-            if self.boss.is_there_shiny:
-                msg += "\U00002728*{}*\U00002728".format(self.boss.name)
-            else:
-                msg += "{}".format(self.boss.name)
-            msg += "\n"
+        msg += "`[{}]`".format(self.code)
 
-        if self.effective_level is not None:
-            msg += "\U00002B50" * self.effective_level
-            msg += "\n"
+        return msg
 
-        msg += "\n"
+    def to_reminder_msgs(self, minutes: int, mentions: int = 50) -> List[str]:
+        # The participants are mentioned in groups, so each message stays within the limits of Telegram
+        head = "\U000023F0 {} `{}` in *{}* min\n".format(helpers.escape_markdown(self.gym.name, version=2),
+                                                         self.hangout.strftime('%H:%M'), minutes)
 
-        if self.hatching is not None:
-            msg += "`Hatching:   {}{}`\n".format("~" if self.is_aprx_time else " ", self.hatching.strftime('%H:%M'))
+        ids = list(self.participants)
 
-        if self.end is not None:
-            msg += "`Ends:       {}{}`\n".format("~" if self.is_aprx_time else " ", self.end.strftime('%H:%M'))
+        return [head + ", ".join(helpers.mention_markdown(p_id, self.participants[p_id].name, version=2)
+                                 for p_id in ids[i:i + mentions])
+                for i in range(0, len(ids), mentions)]
 
-        if self.hangout is not None:
-            msg += "`Hangout:     {}`\n".format(self.hangout.strftime('%H:%M'))
 
-        if self.participants_count > 0:
-            msg += "`─────────────────────`\n"
+_SEPARATOR = "`─────────────────────`\n"
 
-            for p_id, p in self.participants.items():
-                if self.is_check_enabled:
-                    msg += "\U00002705 " if p.is_ready else "\U0000274C "
 
-                msg += helpers.mention_markdown(p_id, p.name, version=2)
+@lru_cache(maxsize=1024)
+def _header(is_ex: bool, gym: str, gym_map: Union[str, None], boss: Union[str, None], is_shiny: bool,
+            level: Union[int, None]) -> str:
+    msg = "*EX*" if is_ex else ""
 
-                if p.is_remote:
-                    msg += " \U0001F3E1"
-                if p.is_remote_invite:
-                    msg += " \U0001F48C"
-                if p.is_flyer:
-                    msg += " \U00002708"
+    if gym_map is not None:
+        msg += "[{}]({})".format(helpers.escape_markdown(gym, version=2), helpers.escape_markdown(gym_map, version=2))
+    else:
+        msg += "{}".format(helpers.escape_markdown(gym, version=2))
 
-                if p.number > 1:
-                    msg += " \\+{}".format(p.number - 1)
+    msg += "\n\n"
 
-                msg += "\n"
+    if boss is not None:
+        msg += "\U00002728*{}*\U00002728\n".format(boss) if is_shiny else "{}\n".format(boss)
 
-            msg += "`─────────────────────`\n"
+    if level is not None:
+        msg += "\U00002B50" * level + "\n"
 
-            if self.is_check_enabled:
-                msg += "__*All participants are ready*__\n" if self.are_all_ready else "__*Not all participants are ready*__\n"
+    return msg + "\n"
 
-            msg += "*{}* participants\n".format(self.participants_count)
 
-        msg += "`[{}]`".format(self.code)
+@lru_cache(maxsize=1024)
+def _times(hatching: datetime.time, end: datetime.time, hangout: datetime.time, is_aprx_time: bool) -> str:
+    msg = ""
 
-        return msg
+    if hatching is not None:
+        msg += "`Hatching:   {}{}`\n".format("~" if is_aprx_time else " ", hatching.strftime('%H:%M'))
+
+    if end is not None:
+        msg += "`Ends:       {}{}`\n".format("~" if is_aprx_time else " ", end.strftime('%H:%M'))
+
+    if hangout is not None:
+        msg += "`Hangout:     {}`\n".format(hangout.strftime('%H:%M'))
+
+    return msg
+
+
+@lru_cache(maxsize=16384)
+def _participant(p_id: int, name: str, participant_type: Participant.Type, number: int, is_check_enabled: bool,
+                 is_ready: bool) -> str:
+    msg = ""
+
+    if is_check_enabled:
+        msg += "\U00002705 " if is_ready else "\U0000274C "
+
+    msg += helpers.mention_markdown(p_id, name, version=2)
+
+    if participant_type == Participant.Type.REMOTE:
+        msg += " \U0001F3E1"
+    if participant_type == Participant.Type.REMOTE_INVITE:
+        msg += " \U0001F48C"
+    if participant_type == Participant.Type.FLYER:
+        msg += " \U00002708"
+
+    if number > 1:
+        msg += " \\+{}".format(number - 1)
+
+    return msg + "\n"
@@ -0,0 +1,245 @@
+from __future__ import annotations
+
+import datetime
+import io
+import pickle
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, Tuple, Union
+
+import msgpack
+
+from . import Raid, Participant
+from .exceptions import InvalidRaidData, UnsupportedRaidVersion
+from ..data import Boss, Gym, bosses, gyms
+
+# Version of the schema, it must be increased on each incompatible change of the tags
+# 2: gyms and bosses of the lists are stored by name
+VERSION = 2
+
+# Tags of the raid fields
+_VERSION = 0
+_PARTICIPANTS = 11
+
+# Tags of the participant fields
+_P_ID = 1
+_P_NAME = 2
+_P_TYPE = 3
+_P_NUMBER = 4
+_P_IS_READY = 5
+_P_JOINED = 6
+
+# Types of participant indexed by value
+_TYPES = {t.value: t for t in Participant.Type}
+
+# Pickle always starts with the PROTO opcode, a raid is never an empty msgpack map
+_PICKLE_PROTO = b"\x80"
+
+
+def _time_to_int(t: datetime.time) -> int:
+    return t.hour * 3600 + t.minute * 60 + t.second
+
+
+@lru_cache(maxsize=2048)
+def _int_to_time(s: int) -> datetime.time:
+    # The times are immutable, so the raids with the same time share it
+    return datetime.time(s // 3600, s // 60 % 60, s % 60)
+
+
+def _same(v: Any) -> Any:
+    return v
+
+
+def _gym_to_wire(g: Gym) -> Union[str, list]:
+    # A gym of the list is stored by name, the others (e.g. found only by the OCR) are embedded
+    # A name shared by more gyms isn't indexed, so those gyms are embedded too
+    return g.name if gyms.get(g.name) == g else [g.name, g.latitude, g.longitude]
+
+
+def _wire_to_gym(g: Union[str, list]) -> Gym:
+    # A gym no longer in the list falls back to its name
+    return (gyms.get(g) or Gym(g)) if isinstance(g, str) else Gym(*g)
+
+
+def _boss_to_wire(b: Boss) -> Union[str, list]:
+    # A boss of the list is stored by name, the others are embedded
+    return b.name if bosses.get(b.name) == b else [b.name, b.level, b.is_there_shiny]
+
+
+def _wire_to_boss(b: Union[str, list]) -> Boss:
+    # A boss no longer in the list falls back to its name
+    return (bosses.get(b) or Boss(b)) if isinstance(b, str) else Boss(*b)
+
+
+# Scalar fields of the raid: attribute -> (tag, default, to wire, from wire)
+_FIELDS: Dict[str, Tuple[int, Any, Callable, Callable]] = {
+    "code": (1, None, _same, _same),
+    "gym": (2, None, _gym_to_wire, _wire_to_gym),
+    "is_ex": (3, False, _same, _same),
+    "level": (4, None, _same, _same),
+    "is_hatched": (5, False, _same, _same),
+    "end": (6, None, _time_to_int, _int_to_time),
+    "hatching": (7, None, _time_to_int, _int_to_time),
+    "hangout": (8, None, _time_to_int, _int_to_time),
+    "boss": (9, None, _boss_to_wire, _wire_to_boss),
+    "is_aprx_time": (10, False, _same, _same),
+    "is_check_enabled": (12, False, _same, _same),
+}
+
+
+def _participant_to_map(p: Participant) -> dict:
+    data = {_P_ID: p.id, _P_NAME: p.name, _P_JOINED: p.joined}
+
+    # Default values are omitted
+    if p.type != Participant.Type.NORMAL:
+        data[_P_TYPE] = int(p.type)
+    if p.number != 1:
+        data[_P_NUMBER] = p.number
+    if p.is_ready:
+        data[_P_IS_READY] = True
+
+    return data
+
+
+def _map_to_participant(data: dict) -> Participant:
+    return Participant(data[_P_ID],
+                       data[_P_NAME],
+                       _TYPES[data[_P_TYPE]] if _P_TYPE in data else Participant.Type.NORMAL,
+                       data.get(_P_NUMBER, 1),
+                       data.get(_P_IS_READY, False),
+                       data.get(_P_JOINED, 0))
+
+
+def _raid_to_map(raid: Raid) -> dict:
+    data = {_VERSION: VERSION}
+
+    # Only the fields that differ from the defaults are stored
+    for name, (tag, default, to_wire, _) in _FIELDS.items():
+        value = getattr(raid, name)
+        if value != default:
+            data[tag] = to_wire(value)
+
+    return data
+
+
+def _map_to_raid(data: dict, participants: Iterable[Participant]) -> Raid:
+    if data.get(_VERSION) is None:
+        raise InvalidRaidData
+
+    if data[_VERSION] > VERSION:
+        raise UnsupportedRaidVersion
+
+    try:
+        # The participants are kept in order of join
+        return Raid(participants={p.id: p for p in sorted(participants, key=lambda p: p.joined)},
+                    **{name: from_wire(data[tag]) if tag in data else default
+                       for name, (tag, default, _, from_wire) in _FIELDS.items()})
+    except (ValueError, KeyError, TypeError) as e:
+        raise InvalidRaidData from e
+
+
+def encode_participant(participant: Participant) -> bytes:
+    return msgpack.packb(_participant_to_map(participant))
+
+
+def decode_participant(data: bytes) -> Participant:
+    try:
+        data = msgpack.unpackb(data, strict_map_key=False)
+
+        # The participants written by the scripts are packed as array when all the tags are present
+        if isinstance(data, list):
+            data = {tag: value for tag, value in enumerate(data, 1)}
+
+        return _map_to_participant(data)
+    except (ValueError, KeyError, TypeError) as e:
+        raise InvalidRaidData from e
+
+
+def encode_fields(raid: Raid, *fields: str) -> Dict[int, bytes]:
+    # Encode each scalar field on its own, an unset field is encoded as nil
+    data = {_VERSION: msgpack.packb(VERSION)}
+
+    for name in fields if len(fields) > 0 else _FIELDS:
+        tag, _, to_wire, _ = _FIELDS[name]
+        value = getattr(raid, name)
+        data[tag] = msgpack.packb(to_wire(value) if value is not None else None)
+
+    return data
+
+
+def decode_fields(fields: Dict[bytes, bytes], participants: Iterable[bytes]) -> Raid:
+    try:
+        data = {int(tag): msgpack.unpackb(value) for tag, value in fields.items()}
+    except ValueError as e:
+        raise InvalidRaidData from e
+
+    return _map_to_raid({tag: value for tag, value in data.items() if value is not None},
+                        [decode_participant(p) for p in participants])
+
+
+def encode(raid: Raid) -> bytes:
+    data = _raid_to_map(raid)
+
+    if len(raid.participants) > 0:
+        data[_PARTICIPANTS] = [_participant_to_map(p) for p in raid.participants.values()]
+
+    return msgpack.packb(data)
+
+
+def decode(data: bytes) -> Raid:
+    # Raids saved by the previous versions
+    if is_legacy(data):
+        return _decode_legacy(data)
+
+    try:
+        data = msgpack.unpackb(data, strict_map_key=False)
+    except ValueError as e:
+        raise InvalidRaidData from e
+
+    if not isinstance(data, dict):
+        raise InvalidRaidData
+
+    try:
+        participants = [_map_to_participant(p) for p in data.get(_PARTICIPANTS, [])]
+    except (ValueError, KeyError, TypeError) as e:
+        raise InvalidRaidData from e
+
+    return _map_to_raid(data, participants)
+
+
+def is_legacy(data: bytes) -> bool:
+    return data[:1] == _PICKLE_PROTO
+
+
+class _LegacyUnpickler(pickle.Unpickler):
+    # Only the classes that were stored in the pickled raids can be loaded
+    ALLOWED = {
+        ("datetime", "time"),
+        ("pogoraidbot.raid", "Raid"),
+        ("pogoraidbot.raid", "Participant"),
+        ("pogoraidbot.raid", "Participant.Type"),
+        ("pogoraidbot.data.gym", "Gym"),
+        ("pogoraidbot.data.boss", "Boss"),
+    }
+
+    def find_class(self, module: str, name: str):
+        if (module, name) not in _LegacyUnpickler.ALLOWED:
+            raise InvalidRaidData("{}.{} is not allowed in a raid".format(module, name))
+
+        return super(_LegacyUnpickler, self).find_class(module, name)
+
+
+def _decode_legacy(data: bytes) -> Raid:
+    try:
+        raid = _LegacyUnpickler(io.BytesIO(data)).load()
+    except (pickle.UnpicklingError, AttributeError, EOFError) as e:
+        raise InvalidRaidData from e
+
+    if not isinstance(raid, Raid):
+        raise InvalidRaidData
+
+    # The pickled participants don't know when they joined, their position is used
+    for i, p in enumerate(raid.participants.values()):
+        if not hasattr(p, "joined"):
+            p.joined = i
+
+    return raid
@@ -0,0 +1,14 @@
+class InvalidRaidData(Exception):
+    pass
+
+
+class UnsupportedRaidVersion(InvalidRaidData):
+    pass
+
+
+class RaidNotFound(Exception):
+    pass
+
+
+class DuplicateOperation(Exception):
+    pass
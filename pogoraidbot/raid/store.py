@@ -0,0 +1,511 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, List, Tuple, Union
+
+from redis import StrictRedis
+from redis.client import Pipeline
+from telegram import User
+
+from . import Raid, Participant, nearest_timestamp
+from . import codec
+from .exceptions import DuplicateOperation, RaidNotFound, InvalidRaidData
+from .. import redis_keys
+
+_LOGGER = logging.getLogger(__package__)
+
+# Applies an operation to a participant of a raid and returns the updated raid, the tags are the ones of the codec
+# It returns nil if the raid doesn't exist and 0 if the operation is a duplicate
+_PARTICIPANT_SCRIPT = """
+local ID, NAME, TYPE, NUMBER, IS_READY, JOINED = 1, 2, 3, 4, 5, 6
+local NORMAL = 1
+
+local op, id, name = ARGV[1], ARGV[2], ARGV[3]
+
+if redis.call("EXISTS", KEYS[1]) == 0 then
+    return nil
+end
+
+-- The same button pressed again by the same user within the window is a double tap
+if tonumber(ARGV[6]) > 0 and not redis.call("SET", KEYS[3], 1, "NX", "PX", ARGV[6]) then
+    return 0
+end
+
+local p = redis.call("HGET", KEYS[2], id)
+if p then
+    p = cmsgpack.unpack(p)
+else
+    p = nil
+end
+
+if op == "add" then
+    if p then
+        p[NAME] = name
+        p[NUMBER] = (p[NUMBER] or 1) + 1
+    else
+        p = {[ID] = tonumber(id), [NAME] = name, [JOINED] = tonumber(ARGV[4])}
+    end
+elseif op == "remove" then
+    if p and (p[NUMBER] or 1) > 1 then
+        p[NAME] = name
+        p[NUMBER] = p[NUMBER] - 1
+        if p[NUMBER] == 1 then
+            p[NUMBER] = nil
+        end
+    elseif p then
+        redis.call("HDEL", KEYS[2], id)
+        p = nil
+    end
+elseif op == "type" then
+    local t = tonumber(ARGV[5])
+    if not p then
+        p = {[ID] = tonumber(id), [JOINED] = tonumber(ARGV[4])}
+    end
+    p[NAME] = name
+    if (p[TYPE] or NORMAL) ~= t then
+        p[TYPE] = t
+    else
+        p[TYPE] = nil
+    end
+elseif op == "ready" then
+    if p then
+        if p[IS_READY] then
+            p[IS_READY] = nil
+        else
+            p[IS_READY] = true
+        end
+    end
+end
+
+if p then
+    redis.call("HSET", KEYS[2], id, cmsgpack.pack(p))
+end
+
+-- The participants expire with the raid
+local ttl = redis.call("PTTL", KEYS[1])
+if ttl > 0 then
+    redis.call("PEXPIRE", KEYS[2], ttl)
+end
+
+return {redis.call("HGETALL", KEYS[1]), redis.call("HVALS", KEYS[2])}
+"""
+
+# Pops the ended raids of a chat with their messages and returns how many raids are still active
+# A pinned message of an ended raid is no longer tracked as pinned
+_SWEEP_SCRIPT = """
+local codes = redis.call("ZRANGEBYSCORE", KEYS[1], "-inf", ARGV[1])
+local pinned = redis.call("GET", KEYS[3])
+local ended = {}
+
+for _, code in ipairs(codes) do
+    local message = redis.call("HGET", KEYS[2], code)
+    local was_pinned = 0
+    if message and message == pinned then
+        redis.call("DEL", KEYS[3])
+        was_pinned = 1
+    end
+    ended[#ended + 1] = {code, message, was_pinned}
+    redis.call("HDEL", KEYS[2], code)
+end
+
+if #codes > 0 then
+    redis.call("ZREM", KEYS[1], unpack(codes))
+end
+
+return {ended, redis.call("ZCARD", KEYS[1])}
+"""
+
+# Writes the fields of a raid only if it still exists, an expired raid isn't created again without expiration
+# A new end moves the expiration of the raid and its score in the index of the chat
+_SAVE_FIELDS_SCRIPT = """
+if redis.call("EXISTS", KEYS[1]) == 0 then
+    return 0
+end
+
+redis.call("HSET", KEYS[1], unpack(ARGV, 4))
+
+if tonumber(ARGV[1]) > 0 then
+    redis.call("EXPIRE", KEYS[1], ARGV[1])
+    redis.call("EXPIRE", KEYS[2], ARGV[1])
+    redis.call("ZADD", KEYS[3], "XX", ARGV[2], ARGV[3])
+end
+
+return 1
+"""
+
+# Deletes the key only if it still holds the value, e.g. an identity still claimed by the raid
+_DELETE_IF_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
+
+
+class RaidStore:
+    def __init__(self, redis: StrictRedis, expiration: int = 60 * 60 * 6, grace: int = 60 * 30,
+                 messages_cache: int = 4096, duplicate_window: float = 1.0):
+        self._redis = redis
+        # Used when the end of the raid is unknown
+        self._expiration = expiration
+        # Time that a raid is kept after its end
+        self._grace = grace
+        # Time within which a second press of the same button by the same user is dropped
+        self._duplicate_window = duplicate_window
+
+        # A message never changes raid, so its lookup can be cached, a mirror belongs to the raid of another chat
+        self._messages: OrderedDict[Tuple[int, int], Tuple[int, str]] = OrderedDict()
+        self._messages_size = messages_cache
+        self._messages_lock = threading.Lock()
+
+        # The mirrors of a raid are sent only with its first post, so once known they never change
+        self._mirrors: OrderedDict[Tuple[int, str], Dict[int, int]] = OrderedDict()
+
+        self._update_participant = self._redis.register_script(_PARTICIPANT_SCRIPT)
+        self._sweep = self._redis.register_script(_SWEEP_SCRIPT)
+        self._delete_if = self._redis.register_script(_DELETE_IF_SCRIPT)
+
+    def load(self, chat_id: int, code: str) -> Raid:
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.hgetall(redis_keys.RAID.format(chat_id, code))
+        pipe.hvals(redis_keys.RAID_PARTICIPANTS.format(chat_id, code))
+        fields, participants = pipe.execute()
+
+        if len(fields) == 0:
+            # The raid may be still saved with the keys of the previous versions
+            return self._load_legacy(chat_id, code)
+
+        return codec.decode_fields(fields, participants)
+
+    @contextmanager
+    def batch(self, pipe: Pipeline = None):
+        # The writes are collected and sent in a single round trip, a batch inside another one joins it
+        if pipe is not None:
+            yield pipe
+            return
+
+        # On a cluster the keys of a batch can be in different slots, so it isn't a transaction
+        # The writes are sent only if the whole batch succeeds, a failed one is discarded
+        pipe = self._redis.pipeline(transaction=False)
+        try:
+            yield pipe
+        except BaseException:
+            pipe.reset()
+            raise
+
+        pipe.execute()
+
+    def save(self, chat_id: int, raid: Raid, pipe: Pipeline = None) -> None:
+        key = redis_keys.RAID.format(chat_id, raid.code)
+        key_participants = redis_keys.RAID_PARTICIPANTS.format(chat_id, raid.code)
+
+        # Replace the whole raid
+        with self.batch(pipe) as pipe:
+            pipe.delete(key, key_participants)
+            pipe.hset(key, mapping=codec.encode_fields(raid))
+            if len(raid.participants) > 0:
+                pipe.hset(key_participants, mapping={p.id: codec.encode_participant(p)
+                                                     for p in raid.participants.values()})
+            # The raid lives until its end and a little more
+            ttl = self._ttl(raid)
+            pipe.expire(key, ttl)
+            pipe.expire(key_participants, ttl)
+
+    def save_fields(self, chat_id: int, raid: Raid, *fields: str, pipe: Pipeline = None) -> None:
+        # Write only the changed scalar fields, the expiration is kept unless the end is changed
+        data = codec.encode_fields(raid, *fields)
+
+        # The script is sent with EVAL, a registered one would check its cache with a round trip on each batch
+        with self.batch(pipe) as pipe:
+            pipe.eval(_SAVE_FIELDS_SCRIPT, 3,
+                      redis_keys.RAID.format(chat_id, raid.code),
+                      redis_keys.RAID_PARTICIPANTS.format(chat_id, raid.code),
+                      redis_keys.CHAT_RAIDS.format(chat_id),
+                      self._ttl(raid) if "end" in fields else 0, self._end_timestamp(raid), raid.code,
+                      *(x for item in data.items() for x in item))
+
+    def add_participant(self, chat_id: int, code: str, user: User) -> Raid:
+        return self._participant_operation(chat_id, code, user, "add")
+
+    def remove_participant(self, chat_id: int, code: str, user: User) -> Raid:
+        return self._participant_operation(chat_id, code, user, "remove")
+
+    def toggle_remote(self, chat_id: int, code: str, user: User) -> Raid:
+        return self._participant_operation(chat_id, code, user, "type", Participant.Type.REMOTE)
+
+    def toggle_remote_invite(self, chat_id: int, code: str, user: User) -> Raid:
+        return self._participant_operation(chat_id, code, user, "type", Participant.Type.REMOTE_INVITE)
+
+    def toggle_flyer(self, chat_id: int, code: str, user: User) -> Raid:
+        return self._participant_operation(chat_id, code, user, "type", Participant.Type.FLYER)
+
+    def toggle_ready(self, chat_id: int, code: str, user: User) -> Raid:
+        return self._participant_operation(chat_id, code, user, "ready")
+
+    def track(self, chat_id: int, raid: Raid, message_id: int, pipe: Pipeline = None) -> None:
+        # Index the raid in its chat by end time and remember its current message in both directions
+        with self.batch(pipe) as pipe:
+            pipe.zadd(redis_keys.CHAT_RAIDS.format(chat_id), {raid.code: self._end_timestamp(raid)})
+            pipe.hset(redis_keys.CHAT_MESSAGES.format(chat_id), raid.code, message_id)
+            pipe.set(redis_keys.CHAT_MESSAGE.format(chat_id, message_id), raid.code, ex=self._ttl(raid))
+            pipe.sadd(redis_keys.CHATS_WITH_RAIDS, chat_id)
+
+        self._remember_message(chat_id, message_id, chat_id, raid.code)
+
+    def track_mirrors(self, chat_id: int, raid: Raid, mirrors: Dict[int, int], pipe: Pipeline = None) -> None:
+        # Remember the messages that mirror the raid in the linked chats, they expire with the raid
+        ttl = self._ttl(raid)
+
+        with self.batch(pipe) as pipe:
+            pipe.hset(redis_keys.RAID_MIRRORS.format(chat_id, raid.code), mapping=mirrors)
+            pipe.expire(redis_keys.RAID_MIRRORS.format(chat_id, raid.code), ttl)
+
+            for mirror_chat_id, message_id in mirrors.items():
+                pipe.set(redis_keys.CHAT_MESSAGE.format(mirror_chat_id, message_id),
+                         "{}:{}".format(chat_id, raid.code), ex=ttl)
+
+        for mirror_chat_id, message_id in mirrors.items():
+            self._remember_message(mirror_chat_id, message_id, chat_id, raid.code)
+
+        self._remember_mirrors(chat_id, raid.code, mirrors)
+
+    def mirrors(self, chat_id: int, code: str) -> Dict[int, int]:
+        with self._messages_lock:
+            if (chat_id, code) in self._mirrors:
+                self._mirrors.move_to_end((chat_id, code))
+                return self._mirrors[(chat_id, code)]
+
+        mirrors = self._redis.hgetall(redis_keys.RAID_MIRRORS.format(chat_id, code))
+        mirrors = {int(c): int(m) for c, m in mirrors.items()}
+
+        # A raid without mirrors may still get them, so it isn't cached
+        if len(mirrors) > 0:
+            self._remember_mirrors(chat_id, code, mirrors)
+
+        return mirrors
+
+    def rendered(self, chat_id: int, raid: Raid, digest: str, pipe: Pipeline = None) -> Union[str, None]:
+        # Remember the digest of the last render of the raid and return the previous one
+        key = redis_keys.CHAT_RENDER.format(chat_id, raid.code)
+
+        # In a batch the previous digest isn't known, the caller has already changed the raid
+        if pipe is not None:
+            pipe.set(key, digest, ex=self._ttl(raid))
+            return None
+
+        previous = self._redis.set(key, digest, ex=self._ttl(raid), get=True)
+
+        return previous.decode() if previous is not None else None
+
+    def forget_render(self, chat_id: int, code: str, digest: str) -> None:
+        # A newer render is kept, its edit may have succeeded
+        self._delete_if(keys=[redis_keys.CHAT_RENDER.format(chat_id, code)], args=[digest])
+
+    def claim(self, chat_id: int, raid: Raid) -> str:
+        identity = raid.identity
+
+        # A raid without gym or end can't be recognized
+        if None in identity:
+            return raid.code
+
+        key = self._identity_key(chat_id, identity)
+        ttl = self._ttl(raid)
+
+        # The first raid with this identity owns it until its expiration, the others get its code
+        while not self._redis.set(key, raid.code, nx=True, ex=ttl):
+            code = self._redis.get(key)
+            if code is not None:
+                return code.decode()
+
+        return raid.code
+
+    def release(self, chat_id: int, raid: Raid) -> None:
+        # The next screenshot of the raid claims it again, e.g. after its post failed
+        identity = raid.identity
+        if None not in identity:
+            self._delete_if(keys=[self._identity_key(chat_id, identity)], args=[raid.code])
+
+    def message(self, chat_id: int, code: str) -> Union[int, None]:
+        message_id = self._redis.hget(redis_keys.CHAT_MESSAGES.format(chat_id), code)
+
+        return int(message_id) if message_id is not None else None
+
+    def find_by_message(self, chat_id: int, message_id: int) -> Union[Tuple[int, str], None]:
+        # Returns the chat and the code of the raid, the chat differs if the message is a mirror
+        key = self._cached_message(chat_id, message_id)
+        if key is not None:
+            return key
+
+        return self._parse_message(chat_id, message_id,
+                                   self._redis.get(redis_keys.CHAT_MESSAGE.format(chat_id, message_id)))
+
+    def load_by_message(self, chat_id: int, message_id: int, code: str = None) -> Tuple[int, Raid]:
+        # Returns the chat and the raid of the message, the code printed in its text is the guess of its raid
+        # A message unknown to the index belongs to that raid, e.g. when it was posted before the index
+        key = self._cached_message(chat_id, message_id)
+        if key is None and code is None:
+            key = self.find_by_message(chat_id, message_id)
+            if key is None:
+                raise RaidNotFound
+
+        if key is not None:
+            return key[0], self.load(*key)
+
+        # Without the cache the guess is read with the index, on the same slot of the chat
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.get(redis_keys.CHAT_MESSAGE.format(chat_id, message_id))
+        pipe.hgetall(redis_keys.RAID.format(chat_id, code))
+        pipe.hvals(redis_keys.RAID_PARTICIPANTS.format(chat_id, code))
+        value, fields, participants = pipe.execute()
+
+        key = self._parse_message(chat_id, message_id, value) or (chat_id, code)
+
+        # A mirror or a raid of the previous versions are loaded apart
+        if key != (chat_id, code) or len(fields) == 0:
+            return key[0], self.load(*key)
+
+        return chat_id, codec.decode_fields(fields, participants)
+
+    def pin(self, chat_id: int, message_id: int, pipe: Pipeline = None) -> None:
+        # Telegram tells the pins with a service message, but not the unpins
+        with self.batch(pipe) as pipe:
+            pipe.set(redis_keys.CHAT_PINNED.format(chat_id), message_id)
+
+    def pinned(self, chat_id: int) -> Union[int, None]:
+        message_id = self._redis.get(redis_keys.CHAT_PINNED.format(chat_id))
+
+        return int(message_id) if message_id is not None else None
+
+    def sweep(self) -> List[Tuple[int, str, int, bool]]:
+        ended = []
+
+        for chat_id in self._redis.smembers(redis_keys.CHATS_WITH_RAIDS):
+            chat_id = int(chat_id)
+
+            raids, active = self._sweep(keys=[redis_keys.CHAT_RAIDS.format(chat_id),
+                                              redis_keys.CHAT_MESSAGES.format(chat_id),
+                                              redis_keys.CHAT_PINNED.format(chat_id)],
+                                        args=[time.time()])
+
+            ended += [(chat_id, code.decode(), int(message_id), bool(pinned)) for code, message_id, pinned in raids
+                      if message_id is not None]
+
+            # A chat is forgotten when it has no more raids, it is added back if a raid was tracked meanwhile
+            if active == 0:
+                self._redis.srem(redis_keys.CHATS_WITH_RAIDS, chat_id)
+                if self._redis.zcard(redis_keys.CHAT_RAIDS.format(chat_id)) > 0:
+                    self._redis.sadd(redis_keys.CHATS_WITH_RAIDS, chat_id)
+
+        return ended
+
+    def _participant_operation(self, chat_id: int, code: str, user: User, operation: str,
+                               participant_type: Participant.Type = Participant.Type.NORMAL,
+                               retry: bool = True) -> Raid:
+        keys = [redis_keys.RAID.format(chat_id, code), redis_keys.RAID_PARTICIPANTS.format(chat_id, code),
+                redis_keys.RAID_PRESS.format(chat_id, code, user.id, operation + str(participant_type.value))]
+
+        # The operation is applied by redis, so concurrent presses are never lost and double taps are dropped
+        result = self._update_participant(keys=keys, args=[operation, user.id, user.full_name,
+                                                           int(time.time() * 1000), participant_type.value,
+                                                           int(self._duplicate_window * 1000)])
+
+        if result == 0:
+            raise DuplicateOperation
+
+        if result is None:
+            if not retry:
+                raise RaidNotFound
+
+            # The raid may be still saved with the keys of the previous versions, convert it and retry
+            self._load_legacy(chat_id, code)
+            return self._participant_operation(chat_id, code, user, operation, participant_type, False)
+
+        fields, participants = result
+
+        return codec.decode_fields(dict(zip(fields[::2], fields[1::2])), participants)
+
+    def _cached_message(self, chat_id: int, message_id: int) -> Union[Tuple[int, str], None]:
+        with self._messages_lock:
+            if (chat_id, message_id) not in self._messages:
+                return None
+
+            self._messages.move_to_end((chat_id, message_id))
+            return self._messages[(chat_id, message_id)]
+
+    def _parse_message(self, chat_id: int, message_id: int, value: Union[bytes, None]) \
+            -> Union[Tuple[int, str], None]:
+        if value is None:
+            return None
+
+        # The mirrors store also the chat of the raid
+        raid_chat_id, _, code = value.decode().rpartition(":")
+        raid_chat_id = int(raid_chat_id) if raid_chat_id != "" else chat_id
+
+        self._remember_message(chat_id, message_id, raid_chat_id, code)
+
+        return raid_chat_id, code
+
+    def _remember_message(self, chat_id: int, message_id: int, raid_chat_id: int, code: str) -> None:
+        with self._messages_lock:
+            self._messages[(chat_id, message_id)] = (raid_chat_id, code)
+            self._messages.move_to_end((chat_id, message_id))
+
+            # The least recently used messages are forgotten
+            while len(self._messages) > self._messages_size:
+                self._messages.popitem(last=False)
+
+    def _remember_mirrors(self, chat_id: int, code: str, mirrors: Dict[int, int]) -> None:
+        with self._messages_lock:
+            self._mirrors[(chat_id, code)] = {**self._mirrors.get((chat_id, code), {}), **mirrors}
+            self._mirrors.move_to_end((chat_id, code))
+
+            while len(self._mirrors) > self._messages_size:
+                self._mirrors.popitem(last=False)
+
+    @staticmethod
+    def _identity_key(chat_id: int, identity: Tuple[str, int, int]) -> str:
+        return redis_keys.CHAT_IDENTITY.format(chat_id, ":".join(str(i) for i in identity))
+
+    def _ttl(self, raid: Raid) -> int:
+        return max(int(self._end_timestamp(raid) - time.time()) + self._grace, 1)
+
+    def _end_timestamp(self, raid: Raid) -> float:
+        if raid.end is None:
+            return time.time() + self._expiration - self._grace
+
+        return nearest_timestamp(raid.end)
+
+    def _load_legacy(self, chat_id: int, code: str) -> Raid:
+        key = redis_keys.LEGACY_RAID.format(code)
+        key_participants = redis_keys.LEGACY_RAID_PARTICIPANTS.format(code)
+
+        key_type = self._redis.type(key)
+        ttl = self._redis.ttl(key)
+
+        try:
+            # A single blob or the fields without hash tag
+            if key_type == b"string":
+                raid = codec.decode(self._redis.get(key))
+            elif key_type == b"hash":
+                raid = codec.decode_fields(self._redis.hgetall(key), self._redis.hvals(key_participants))
+            else:
+                raise RaidNotFound
+        except InvalidRaidData:
+            raise RaidNotFound
+
+        _LOGGER.info("Raid {} is moved in chat {}".format(code, chat_id))
+
+        # Move the raid under the keys of its chat keeping its expiration
+        with self.batch() as pipe:
+            self.save(chat_id, raid, pipe)
+            if ttl > 0:
+                pipe.expire(redis_keys.RAID.format(chat_id, code), ttl)
+                pipe.expire(redis_keys.RAID_PARTICIPANTS.format(chat_id, code), ttl)
+            pipe.delete(key)
+            pipe.delete(key_participants)
+
+        return raid
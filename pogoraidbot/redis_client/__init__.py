@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+import logging
+from typing import Dict, List, Tuple, Union
+from urllib.parse import parse_qs, unquote
+
+from redis import exceptions
+from redis.backoff import ExponentialBackoff
+from redis.cluster import ClusterNode
+from redis.retry import Retry
+from redis.sentinel import Sentinel
+
+from ..metrics import CountingRedis, CountingRedisCluster
+
+_LOGGER = logging.getLogger(__package__)
+
+SENTINEL_SCHEME = "redis+sentinel"
+CLUSTER_SCHEME = "redis+cluster"
+
+
+def _parse_nodes(url: str) -> Tuple[Union[str, None], List[Tuple[str, int]], List[str], Dict[str, str]]:
+    # "scheme://[:password@]host:port[,host:port...][/path...][?option=value&...]"
+    location = url.split("://", 1)[1]
+    location, _, query = location.partition("?")
+    location, _, path = location.partition("/")
+
+    password = None
+    if "@" in location:
+        credentials, location = location.rsplit("@", 1)
+        password = unquote(credentials.split(":", 1)[-1]) or None
+
+    nodes = []
+    for node in location.split(","):
+        host, _, port = node.rpartition(":")
+        nodes.append((host, int(port)))
+
+    query = {k: v[-1] for k, v in parse_qs(query).items()}
+
+    return password, nodes, [p for p in path.split("/") if p != ""], query
+
+
+def connect(url: str, pool_size: int = 32, health_check_interval: int = 30) -> Union[CountingRedis,
+                                                                                       CountingRedisCluster]:
+    # Options shared by all the kinds of deployment
+    options = {
+        "health_check_interval": health_check_interval,
+        "socket_keepalive": True,
+        "retry": Retry(ExponentialBackoff(cap=10, base=0.1), 5),
+        "retry_on_error": [exceptions.ConnectionError, exceptions.TimeoutError],
+        "max_connections": pool_size
+    }
+
+    # "redis+sentinel://[:password@]host:port[,host:port...]/service[/db][?sentinel_password=password]"
+    if url.startswith(SENTINEL_SCHEME + "://"):
+        password, nodes, path, query = _parse_nodes(url)
+        if len(path) == 0:
+            raise ValueError("The sentinel url requires the name of the service")
+
+        _LOGGER.info("Using the redis service {} of the sentinels {}".format(path[0], nodes))
+
+        # The password of the url is the one of the master, the sentinels usually have none or their own
+        sentinel = Sentinel(nodes, sentinel_kwargs={"password": query.get("sentinel_password"),
+                                                    "socket_keepalive": True})
+
+        # The client follows the master after each failover
+        return sentinel.master_for(path[0], redis_class=CountingRedis, password=password,
+                                   db=int(path[1]) if len(path) > 1 else 0, **options)
+
+    # "redis+cluster://[:password@]host:port[,host:port...]"
+    if url.startswith(CLUSTER_SCHEME + "://"):
+        password, nodes, _, _ = _parse_nodes(url)
+
+        _LOGGER.info("Using the redis cluster {}".format(nodes))
+
+        # The cluster client handles the reconnections and the failovers by itself and refreshes its slots map
+        return CountingRedisCluster(startup_nodes=[ClusterNode(host, port) for host, port in nodes],
+                                    password=password, socket_keepalive=True, retry=options["retry"],
+                                    max_connections=pool_size)
+
+    # A single instance as "redis://", "rediss://" or "unix://"
+    return CountingRedis.from_url(url, **options)
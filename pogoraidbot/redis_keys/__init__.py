@@ -1,8 +1,40 @@
+# The keys of a chat share the hash tag {chat_id}, so on a Redis Cluster they are stored in the same slot
 CONFIG = "config:{}"
 
 SUPERADMIN = CONFIG.format("superadmin")
 ADMIN = CONFIG.format("admin")
 DISABLEDSCAN = CONFIG.format("disablescan")
 ENABLEDCHAT = CONFIG.format("enabledchat")
+# Links between the chats as "origin:mirror"
+MIRROR = CONFIG.format("mirror")
+CONFIG_CHANGES = CONFIG.format("changes")
 
-RAID = "raid:{}"
\ No newline at end of file
+CHAT = "chat:{{{}}}"
+
+CHAT_RAIDS = CHAT + ":raids"
+CHAT_MESSAGES = CHAT + ":messages"
+CHAT_IDENTITY = CHAT + ":identity:{}"
+CHAT_MESSAGE = CHAT + ":message:{}"
+CHAT_RENDER = CHAT + ":render:{}"
+CHAT_PINNED = CHAT + ":pinned"
+CHATS_WITH_RAIDS = "chats:raids"
+# Raids to remind as "chat_id:code", scored by the time of the reminder
+REMINDERS = "reminders"
+
+RAID = CHAT + ":raid:{}"
+RAID_PARTICIPANTS = RAID + ":participants"
+RAID_PRESS = RAID + ":press:{}:{}"
+RAID_MIRRORS = RAID + ":mirrors"
+
+# Raids saved before the hash tags
+LEGACY_RAID = "raid:{}"
+LEGACY_RAID_PARTICIPANTS = LEGACY_RAID + ":participants"
+
+CLUSTER = "cluster:{}"
+
+LEADER = CLUSTER.format("leader")
+UPDATES = CLUSTER.format("{updates}")
+UPDATES_OFFSET = UPDATES + ":offset"
+UPDATE = CLUSTER.format("update:{}")
+
+DATA = "data:{}"
@@ -0,0 +1,180 @@
+from __future__ import annotations
+
+import logging
+import math
+import threading
+import time
+from typing import Any, Callable, List, Tuple
+
+from redis import StrictRedis
+from redis.client import Pipeline
+
+from .. import redis_keys
+from ..raid import Raid, nearest_timestamp
+
+_LOGGER = logging.getLogger(__package__)
+
+# Leases the reminders due within the horizon, their score is moved forward so the other replicas skip them
+# If the replica dies before sending them, they are due again when the lease ends
+_CLAIM_SCRIPT = """
+local due = redis.call("ZRANGEBYSCORE", KEYS[1], "-inf", ARGV[1], "WITHSCORES", "LIMIT", 0, ARGV[3])
+
+for i = 1, #due, 2 do
+    redis.call("ZADD", KEYS[1], "XX", due[i + 1] + ARGV[2], due[i])
+end
+
+return due
+"""
+
+# Removes the reminders still leased with the given score, a reminder moved meanwhile is kept
+_COMPLETE_SCRIPT = """
+local completed = {}
+
+for i = 1, #ARGV, 2 do
+    local score = redis.call("ZSCORE", KEYS[1], ARGV[i])
+    if score and tonumber(score) == tonumber(ARGV[i + 1]) then
+        redis.call("ZREM", KEYS[1], ARGV[i])
+        completed[#completed + 1] = ARGV[i]
+    end
+end
+
+return completed
+"""
+
+
+class TimerWheel:
+    def __init__(self, tick: float = 1.0, slots: Tuple[int, ...] = (60, 60, 24)):
+        self._tick = tick
+        self._slots = slots
+        self._start = time.time()
+
+        # Each wheel counts the turns of the previous one, e.g. seconds, minutes and hours
+        self._spans = [1]
+        for n in slots[:-1]:
+            self._spans.append(self._spans[-1] * n)
+        self._wheels: List[List[List[Tuple[int, Any]]]] = [[[] for _ in range(n)] for n in slots]
+
+        # Ticks elapsed since the start
+        self._current = 0
+
+    def add(self, due: float, item: Any) -> None:
+        # A timer already due fires with the next tick
+        self._add(max(math.ceil((due - self._start) / self._tick), self._current + 1), item)
+
+    def advance(self, now: float) -> List[Any]:
+        # Moves the wheels up to now and returns the items of the timers fired on the way
+        fired = []
+
+        while self._current < int((now - self._start) / self._tick):
+            self._current += 1
+
+            # At each turn a wheel moves the timers of its next slot down to the lower wheels
+            for level in range(len(self._slots) - 1, 0, -1):
+                if self._current % self._spans[level] == 0:
+                    slot = self._wheels[level][(self._current // self._spans[level]) % self._slots[level]]
+                    timers, slot[:] = slot[:], []
+                    for tick, item in timers:
+                        self._add(tick, item)
+
+            slot = self._wheels[0][self._current % self._slots[0]]
+            fired += [item for _, item in slot]
+            slot.clear()
+
+        return fired
+
+    def _add(self, tick: int, item: Any) -> None:
+        for level, (n, span) in enumerate(zip(self._slots, self._spans)):
+            if tick // span - self._current // span < n:
+                self._wheels[level][(tick // span) % n].append((tick, item))
+                return
+
+        # A timer beyond the last wheel waits in its farthest slot and is placed again when it's reached
+        level = len(self._slots) - 1
+        self._wheels[level][(self._current // self._spans[level] - 1) % self._slots[level]].append((tick, item))
+
+
+class Reminders:
+    def __init__(self, redis: StrictRedis, notify: Callable[[int, str], None], lead: int = 5 * 60,
+                 horizon: int = 60, lease: int = 5 * 60, batch: int = 256):
+        self._redis = redis
+        # Called with the chat and the code of each raid to remind
+        self._notify = notify
+        # Time before the hangout when the participants are reminded
+        self._lead = lead
+        # Each claim takes the reminders due within the horizon, they wait in the wheel until their time
+        self._horizon = horizon
+        # Time after which the reminders claimed by a dead replica are claimed again
+        self._lease = lease
+        self._batch = batch
+
+        self._wheel = TimerWheel()
+
+        self._claim = self._redis.register_script(_CLAIM_SCRIPT)
+        self._complete = self._redis.register_script(_COMPLETE_SCRIPT)
+
+    @property
+    def is_enabled(self) -> bool:
+        return self._lead > 0
+
+    def schedule(self, chat_id: int, raid: Raid, pipe: Pipeline = None) -> None:
+        if not self.is_enabled or raid.hangout is None:
+            return
+
+        hangout = nearest_timestamp(raid.hangout)
+        if hangout <= time.time():
+            return
+
+        # A new hangout moves the reminder of the raid, also if another replica claimed it
+        due = max(int(hangout - self._lead), int(time.time()))
+        (pipe or self._redis).zadd(redis_keys.REMINDERS, {"{}:{}".format(chat_id, raid.code): due})
+
+    def start(self) -> None:
+        if self.is_enabled:
+            threading.Thread(target=self._loop, name="reminders", daemon=True).start()
+
+    def _loop(self) -> None:
+        # A single thread claims the reminders and fires them, instead of a job for each one
+        claimed_until = 0.0
+
+        while True:
+            try:
+                now = time.time()
+
+                if now + self._horizon / 2 >= claimed_until:
+                    self._take(now + self._horizon)
+                    claimed_until = now + self._horizon
+
+                fired = self._wheel.advance(now)
+                if len(fired) > 0:
+                    self._fire(fired)
+
+            except Exception as e:
+                _LOGGER.warning("Reminders loop failed: {}".format(e))
+
+            time.sleep(1.0 - time.time() % 1.0)
+
+    def _take(self, until: float) -> None:
+        while True:
+            due = self._claim(keys=[redis_keys.REMINDERS], args=[int(until), self._lease, self._batch])
+
+            for member, score in zip(due[::2], due[1::2]):
+                # The timer keeps the leased score, it proves that the reminder wasn't moved meanwhile
+                self._wheel.add(float(score), (member.decode(), int(float(score)) + self._lease))
+
+            if len(due) < self._batch * 2:
+                return
+
+    def _fire(self, fired: List[Tuple[str, int]]) -> None:
+        # The reminders are completed together, only the ones still leased by this replica are sent
+        args = [x for member, score in fired for x in (member, score)]
+        completed = self._complete(keys=[redis_keys.REMINDERS], args=args)
+
+        _LOGGER.debug("{} reminders fired, {} to send".format(len(fired), len(completed)))
+
+        for member in completed:
+            chat_id, _, code = member.decode().rpartition(":")
+
+            try:
+                self._notify(int(chat_id), code)
+            except Exception as e:
+                _LOGGER.warning("Unable to remind raid {} of chat {}: {}".format(code, chat_id, e))
@@ -10,6 +10,8 @@ import numpy as np
 import pytesseract
 
 from . import resources
+from .download import Downloader
+from .governor import MemoryGovernor
 from ..cachedmethod import CachedMethod
 from ..data import Boss, Gym, gyms, bosses
 from ..exceptions import HatchingTimerNotFound, HatchingTimerUnreadable, RaidTimerNotFound, RaidTimerUnreadable, \
@@ -25,12 +27,13 @@ _LOGGER = logging.getLogger(__package__)
 class ScreenshotRaid:
     debug = False
 
-    def __init__(self, img: Union[np.ndarray, bytearray]):
+    def __init__(self, img: Union[np.ndarray, bytes, bytearray, memoryview]):
 
         if isinstance(img, np.ndarray):
             self._img = img
-        elif isinstance(img, bytearray):
-            self._img = cv2.imdecode(np.asarray(img, dtype="uint8"), cv2.IMREAD_COLOR)
+        elif isinstance(img, (bytes, bytearray, memoryview)):
+            # The encoded image is decoded straight from the buffer, without copying it
+            self._img = cv2.imdecode(np.frombuffer(img, dtype=np.uint8), cv2.IMREAD_COLOR)
         else:
             raise Exception  # TODO: create adhoc exception
 
@@ -38,12 +41,27 @@ class ScreenshotRaid:
             self._image_sections = {}
 
         self._size = (len(self._img[0]), len(self._img))
+        self._memory = self._img.nbytes
 
         self._anchors = {}
         self._anchors_available = 0
 
         self._find_anchors()
 
+    @property
+    def memory(self) -> int:
+        # Bytes of the decoded screenshot, the biggest allocation of the scan
+        return self._memory
+
+    def release(self) -> None:
+        # The sections are still needed to save the debug images
+        if ScreenshotRaid.debug:
+            return
+
+        # Drop the full image and the anchors, all the sections must be already read
+        self._img = None
+        self._anchors = {}
+
     def _calc_subset(self, *subs) -> Rect:
         if len(subs) == 1 and isinstance(subs[0], tuple):
             subs = subs[0]
@@ -0,0 +1,77 @@
+from __future__ import annotations
+
+import logging
+import time
+from contextlib import contextmanager
+from threading import Lock
+from typing import List
+
+import requests
+from requests.adapters import HTTPAdapter
+from telegram import File
+
+_LOGGER = logging.getLogger(__package__)
+
+
+class Downloader:
+    def __init__(self, pool_size: int = 2, buffer_size: int = 512 * 1024, timeout: float = 30):
+        # The connections to the file server are kept alive and shared by the scans
+        self._session = requests.Session()
+        self._session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        self._timeout = timeout
+
+        # Buffers free to be reused, a scan takes one for each download
+        self._buffers: List[bytearray] = []
+        self._buffer_size = buffer_size
+        self._lock = Lock()
+
+    @contextmanager
+    def download(self, file: File):
+        # Yields a view of the content, it is valid only inside the block
+        buffer = self._take(file.file_size or 0)
+
+        try:
+            start = time.monotonic()
+
+            with self._session.get(file.file_path, stream=True, timeout=self._timeout) as response:
+                response.raise_for_status()
+                size = self._read_into(response.raw, buffer)
+
+            _LOGGER.debug("Downloaded {} bytes in {:.0f} ms".format(size, (time.monotonic() - start) * 1000))
+
+            # The view is released before the buffer is reused, so it can grow again
+            view = memoryview(buffer)[:size]
+            try:
+                yield view
+            finally:
+                view.release()
+        finally:
+            with self._lock:
+                self._buffers.append(buffer)
+
+    def _take(self, size: int) -> bytearray:
+        with self._lock:
+            buffer = self._buffers.pop() if len(self._buffers) > 0 else bytearray(self._buffer_size)
+
+        # The buffer grows to the expected size at once, instead of while reading
+        if len(buffer) < size:
+            buffer.extend(bytes(size - len(buffer)))
+
+        return buffer
+
+    @staticmethod
+    def _read_into(raw, buffer: bytearray) -> int:
+        size = 0
+
+        while True:
+            # A file bigger than expected doubles the buffer, no view of it can be alive here
+            if size == len(buffer):
+                buffer.extend(bytes(len(buffer)))
+
+            with memoryview(buffer) as view:
+                read = raw.readinto(view[size:])
+
+            if not read:
+                return size
+
+            size += read
@@ -0,0 +1,41 @@
+from __future__ import annotations
+
+import logging
+from contextlib import contextmanager
+from threading import Condition
+
+_LOGGER = logging.getLogger(__package__)
+
+
+class MemoryGovernor:
+    def __init__(self, limit: int):
+        self._limit = limit
+        self._in_use = 0
+        self._peak = 0
+        self._condition = Condition()
+
+    @property
+    def in_use(self) -> int:
+        return self._in_use
+
+    @property
+    def peak(self) -> int:
+        return self._peak
+
+    @contextmanager
+    def reserve(self, size: int):
+        with self._condition:
+            # Wait for enough free memory, a request bigger than the limit waits to be alone
+            if not self._condition.wait_for(lambda: self._in_use == 0 or self._in_use + size <= self._limit, 0):
+                _LOGGER.info("Waiting for {} bytes of memory for a scan".format(size))
+                self._condition.wait_for(lambda: self._in_use == 0 or self._in_use + size <= self._limit)
+
+            self._in_use += size
+            self._peak = max(self._peak, self._in_use)
+
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._in_use -= size
+                self._condition.notify_all()
@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+import hmac
+import json
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from queue import Queue
+from threading import BoundedSemaphore
+from typing import Tuple
+
+from telegram import Bot, Update
+
+_LOGGER = logging.getLogger(__package__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    server: WebhookServer
+
+    def do_POST(self) -> None:
+        # Accept only the configured path
+        if self.path.rstrip("/") != self.server.path.rstrip("/"):
+            self._reply(404)
+            return
+
+        # Validate the secret token sent by Telegram
+        if self.server.secret is not None and not hmac.compare_digest(
+                self.headers.get(SECRET_HEADER, ""), self.server.secret):
+            _LOGGER.warning("Webhook request with an invalid secret from {}".format(self.client_address[0]))
+            self._reply(403)
+            return
+
+        # Bound the number of requests processed at the same time, Telegram retries the refused ones
+        if not self.server.slots.acquire(timeout=self.server.slot_timeout):
+            _LOGGER.warning("Webhook is saturated, an update was refused")
+            self._reply(503)
+            return
+
+        try:
+            raw = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+            try:
+                update = Update.de_json(json.loads(raw), self.server.bot)
+            except ValueError:
+                _LOGGER.warning("Webhook received an invalid update")
+                self._reply(400)
+                return
+
+            _LOGGER.debug("Received update {} over webhook".format(update.update_id))
+
+            # Feed the update to the dispatcher
+            self.server.update_queue.put(update)
+            self._reply(200)
+        finally:
+            self.server.slots.release()
+
+    def _reply(self, code: int) -> None:
+        self.send_response(code)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format: str, *args) -> None:
+        _LOGGER.debug(format % args)
+
+
+class WebhookServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self,
+                 address: Tuple[str, int],
+                 bot: Bot,
+                 update_queue: Queue,
+                 path: str = "/",
+                 secret: str = None,
+                 max_connections: int = 40,
+                 slot_timeout: float = 5):
+        super(WebhookServer, self).__init__(address, WebhookHandler)
+
+        self.bot = bot
+        self.update_queue = update_queue
+        self.path = path if path.startswith("/") else "/" + path
+        self.secret = secret
+        self.slots = BoundedSemaphore(max_connections)
+        self.slot_timeout = slot_timeout
@@ -22,11 +22,12 @@ setup(
         'python-telegram-bot ~= 12.7',
         'opencv-python ~= 4.1',
         'pytesseract ~= 0.3',
-        'redis ~= 3.5',
+        'redis ~= 4.3',
         'requests ~= 2.22',
         'schema ~= 0.7',
         'apscheduler ~= 3.6',
-        'mpu ~= 0.23'
+        'mpu ~= 0.23',
+        'msgpack ~= 1.0'
     ],
     classifiers=[
         'Development Status :: 4 - Beta',